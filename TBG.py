@@ -1,67 +1,35 @@
-import logging
-log = logging.getLogger(__name__)
-
-import sys
-from datetime import datetime
-from pathlib import Path
-
-from settings import settings
-
-from pymeasure.display.Qt import QtWidgets
-from pymeasure.display.windows import ManagedWindow
-from pymeasure.experiment import Results, unique_filename
-
-from procedures import TBGProcedure
-
-class MainWindow(ManagedWindow):
-    def __init__(self):
-        super().__init__(
-            procedure_class=TBGProcedure,
-            inputs=[
-                'sample',
-                'temperature_SP',
-                'temperature_ctrl_active',
-                'mag_field_SP',
-                'mag_field_ctrl_active',
-                'drain_current_SP',
-                'gate_voltage_min',
-                'gate_voltage_max',
-                'gate_voltage_step'
-            ],
-            displays=[
-                'temperature_SP',
-                'mag_field_SP',
-                'sample'
-            ],
-            x_axis='Vg',
-            y_axis='Rds',
-            sequencer=True,
-            sequencer_inputs=['temperature_SP', 'mag_field_SP'],
-            sequence_file="TBG.txt",
-        )
-        self.setWindowTitle('TBG Experiment')
-
-
-    def queue(self, procedure=None):
-        if procedure is None:
-            procedure = self.make_procedure()
-
-        filename = unique_filename(
-            directory=Path(settings['out_dir']), 
-            procedure=procedure, 
-            prefix='DATA-TBG_{Sample}_T={Temperature SP}_B={Mag field SP}_',
-        )
-        
-        log.info(f'Creating new experiment {procedure.__class__.__name__}. Output file: "{filename}"')
-        results = Results(procedure, filename)
-        experiment = self.new_experiment(results)
-
-        self.manager.queue(experiment)
+import os
+
+_SEQ_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TBG.txt")
+
+# Qt, pymeasure and the procedures are imported in main() only, so that
+# importing this module just to read the window options stays cheap.
+WINDOW_OPTIONS = dict(
+    inputs=(
+        'sample',
+        'temperature_SP',
+        'temperature_ctrl_active',
+        'mag_field_SP',
+        'mag_field_ctrl_active',
+        'drain_current_SP',
+        'gate_voltage_min',
+        'gate_voltage_max',
+        'gate_voltage_step'
+    ),
+    x_axis='Vg',
+    y_axis='Rds',
+    sequence_file=_SEQ_FILE,
+    prefix='DATA-TBG_{Sample}_T={Temperature SP}_B={Mag field SP}_',
+    title='TBG Experiment',
+)
+
+
+def main():
+    from procedures import TBGProcedure
+    from tb_window import make_main_window, run_app
+
+    run_app(make_main_window(procedure_class=TBGProcedure, **WINDOW_OPTIONS))
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec())
-    
\ No newline at end of file
+    main()
@@ -1,66 +1,34 @@
-import logging
-log = logging.getLogger(__name__)
-
-import sys
-from datetime import datetime
-from pathlib import Path
-
-from settings import settings
-
-from pymeasure.display.Qt import QtWidgets
-from pymeasure.display.windows import ManagedWindow
-from pymeasure.experiment import Results, unique_filename
-
-from procedures import TBIVProcedure
-
-class MainWindow(ManagedWindow):
-    def __init__(self):
-        super().__init__(
-            procedure_class=TBIVProcedure,
-            inputs=[
-                'sample',
-                'temperature_SP',
-                'temperature_ctrl_active',
-                'mag_field_SP',
-                'mag_field_ctrl_active',
-                'drain_currennt_min',
-                'drain_currennt_max',
-                'drain_currennt_step'
-            ],
-            displays=[
-                'temperature_SP',
-                'mag_field_SP',
-                'sample'
-            ],
-            x_axis='Id',
-            y_axis='Vd',
-            sequencer=True,
-            sequencer_inputs=['temperature_SP', 'mag_field_SP'],
-            sequence_file="TBIV.txt",
-        )
-        self.setWindowTitle('TBIV Experiment')
-
-
-    def queue(self, procedure=None):
-        if procedure is None:
-            procedure = self.make_procedure()
-
-        filename = unique_filename(
-            directory=Path(settings['out_dir']), 
-            procedure=procedure, 
-            prefix='DATA-TBIV_{Sample}_T={Temperature SP}_B={Mag field SP}_',
-        )
-        
-        log.info(f'Creating new experiment {procedure.__class__.__name__}. Output file: "{filename}"')
-        results = Results(procedure, filename)
-        experiment = self.new_experiment(results)
-
-        self.manager.queue(experiment)
+import os
+
+_SEQ_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TBIV.txt")
+
+# Qt, pymeasure and the procedures are imported in main() only, so that
+# importing this module just to read the window options stays cheap.
+WINDOW_OPTIONS = dict(
+    inputs=(
+        'sample',
+        'temperature_SP',
+        'temperature_ctrl_active',
+        'mag_field_SP',
+        'mag_field_ctrl_active',
+        'drain_current_min',
+        'drain_current_max',
+        'drain_current_step'
+    ),
+    x_axis='Id',
+    y_axis='Vd',
+    sequence_file=_SEQ_FILE,
+    prefix='DATA-TBIV_{Sample}_T={Temperature SP}_B={Mag field SP}_',
+    title='TBIV Experiment',
+)
+
+
+def main():
+    from procedures import TBIVProcedure
+    from tb_window import make_main_window, run_app
+
+    run_app(make_main_window(procedure_class=TBIVProcedure, **WINDOW_OPTIONS))
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec())
-    
\ No newline at end of file
+    main()
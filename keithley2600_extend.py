@@ -6,32 +6,510 @@ Created on Tue Oct  4 14:12:33 2022
 """
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import (
-    IO,
+    Callable,
     Optional,
-    Any,
     Dict,
     Union,
-    List,
     Tuple,
-    Set,
     Sequence,
-    Iterable,
-    Iterator,
 )
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from keithley2600.keithley_driver import Keithley2600, KeithleyClass
+from keithley2600.keithley_driver import Keithley2600, KeithleyClass, KeithleyIOError
+from pyvisa import constants as visa_constants
+from pyvisa.errors import VisaIOError
 
 
 logger = logging.getLogger(__name__)
 
 
+# columns of the DataFrames returned by the transfer and IV measurements
+_TRANSFER_I_COLUMNS = ('Vg_SP', 'Id_SP', 'Vg_dir_fwd', 'Vg', 'Ig', 'Vd', 'Id')
+_TRANSFER_V_COLUMNS = ('Vg_SP', 'Vd_SP', 'Vg', 'Ig', 'Vd', 'Id')
+_IV_V_COLUMNS = _TRANSFER_V_COLUMNS
+
+
+# TSP functions which configure the trigger model of a sweep and start it. They are
+# uploaded once per connection, so that each sweep needs a single write instead of
+# one round-trip per attribute. The sweep lists must already be set on the SMUs.
+# Sweeps call them through wrappers with all but ``npts`` fixed, see
+# _Keithley2600Extend._define_sweep_function.
+
+_DUAL_SWEEP_SCRIPT = """
+function tb_dual_sweep(smui, smuv, dispi, dispv, nplc, delay, fcount, endpulse, npts)
+    smui.trigger.source.action = smui.ENABLE
+    smuv.trigger.source.action = smuv.ENABLE
+
+    -- CONFIGURE INTEGRATION TIME AND SETTLING TIME FOR EACH MEASUREMENT
+    smui.measure.nplc = nplc
+    smuv.measure.nplc = nplc
+    smui.measure.delay = delay
+    smuv.measure.delay = delay
+
+    -- average fcount readings per data point, a count of 1 leaves the
+    -- filter settings of the instrument unchanged
+    if fcount > 1 then
+        smui.measure.filter.type = smui.FILTER_REPEAT_AVG
+        smuv.measure.filter.type = smuv.FILTER_REPEAT_AVG
+        smui.measure.filter.count = fcount
+        smuv.measure.filter.count = fcount
+        smui.measure.filter.enable = smui.FILTER_ON
+        smuv.measure.filter.enable = smuv.FILTER_ON
+    end
+
+    -- enable autorange if not in high capacitance mode
+    if smui.source.highc == smui.DISABLE then smui.measure.autorangev = smui.AUTORANGE_ON end
+    if smuv.source.highc == smuv.DISABLE then smuv.measure.autorangei = smuv.AUTORANGE_ON end
+
+    smui.source.func = smui.OUTPUT_DCAMPS
+    smuv.source.func = smuv.OUTPUT_DCVOLTS
+
+    -- CLEAR BUFFERS
+    smui.nvbuffer1.clear() smui.nvbuffer2.clear()
+    smui.nvbuffer1.clearcache() smui.nvbuffer2.clearcache()
+    smuv.nvbuffer1.clear() smuv.nvbuffer2.clear()
+    smuv.nvbuffer1.clearcache() smuv.nvbuffer2.clearcache()
+
+    -- display voltage of smui and current of smuv during measurement
+    dispi.measure.func = display.MEASURE_DCVOLTS
+    dispv.measure.func = display.MEASURE_DCAMPS
+
+    -- trigger count = number of data points in measurement
+    smui.trigger.count = npts
+    smuv.trigger.count = npts
+
+    -- measure current and voltage into the buffers once smui has sourced
+    smui.trigger.measure.action = smui.ENABLE
+    smuv.trigger.measure.action = smuv.ENABLE
+    smui.trigger.measure.iv(smui.nvbuffer1, smui.nvbuffer2)
+    smuv.trigger.measure.iv(smuv.nvbuffer1, smuv.nvbuffer2)
+    smui.trigger.measure.stimulus = smui.trigger.SOURCE_COMPLETE_EVENT_ID
+    smuv.trigger.measure.stimulus = smui.trigger.SOURCE_COMPLETE_EVENT_ID
+
+    -- SOURCE_IDLE (0) for pulsed sweeps, SOURCE_HOLD (1) otherwise
+    smui.trigger.endpulse.action = endpulse
+    smuv.trigger.endpulse.action = endpulse
+    smui.trigger.endsweep.action = endpulse
+    smuv.trigger.endsweep.action = endpulse
+
+    -- arm -> trigger transition on *trg
+    smui.trigger.arm.stimulus = trigger.EVENT_ID
+
+    -- blender 1: source on entering the trigger layer or after each pulse
+    trigger.blender[1].orenable = true
+    trigger.blender[1].stimulus[1] = smui.trigger.ARMED_EVENT_ID
+    trigger.blender[1].stimulus[2] = smui.trigger.PULSE_COMPLETE_EVENT_ID
+    smui.trigger.source.stimulus = trigger.blender[1].EVENT_ID
+
+    -- blender 2: end the pulse once both SMUs have measured
+    trigger.blender[2].orenable = false
+    trigger.blender[2].stimulus[1] = smui.trigger.MEASURE_COMPLETE_EVENT_ID
+    trigger.blender[2].stimulus[2] = smuv.trigger.MEASURE_COMPLETE_EVENT_ID
+    smui.trigger.endpulse.stimulus = trigger.blender[2].EVENT_ID
+
+    smui.source.output = smui.OUTPUT_ON
+    smuv.source.output = smuv.OUTPUT_ON
+
+    -- prepare SMUs to wait for trigger
+    smui.trigger.initiate()
+    smuv.trigger.initiate()
+end
+"""
+
+_SINGLE_SWEEP_SCRIPT = """
+function tb_single_sweep(smu, disp, nplc, delay, fcount, endpulse, npts)
+    smu.trigger.source.action = smu.ENABLE
+
+    -- CONFIGURE INTEGRATION TIME AND SETTLING TIME FOR EACH MEASUREMENT
+    smu.measure.nplc = nplc
+    smu.measure.delay = delay
+
+    -- average fcount readings per data point, a count of 1 leaves the
+    -- filter settings of the instrument unchanged
+    if fcount > 1 then
+        smu.measure.filter.type = smu.FILTER_REPEAT_AVG
+        smu.measure.filter.count = fcount
+        smu.measure.filter.enable = smu.FILTER_ON
+    end
+
+    -- enable autorange if not in high capacitance mode
+    if smu.source.highc == smu.DISABLE then smu.measure.autorangei = smu.AUTORANGE_ON end
+
+    smu.source.func = smu.OUTPUT_DCAMPS
+
+    -- CLEAR BUFFERS
+    smu.nvbuffer1.clear() smu.nvbuffer2.clear()
+    smu.nvbuffer1.clearcache() smu.nvbuffer2.clearcache()
+
+    -- display voltage during measurement
+    disp.measure.func = display.MEASURE_DCVOLTS
+
+    -- trigger count = number of data points in measurement
+    smu.trigger.count = npts
+
+    -- measure current and voltage into the buffers once the source is complete
+    smu.trigger.measure.action = smu.ENABLE
+    smu.trigger.measure.iv(smu.nvbuffer1, smu.nvbuffer2)
+    smu.trigger.measure.stimulus = smu.trigger.SOURCE_COMPLETE_EVENT_ID
+
+    -- SOURCE_IDLE (0) for pulsed sweeps, SOURCE_HOLD (1) otherwise
+    smu.trigger.endpulse.action = endpulse
+    smu.trigger.endsweep.action = endpulse
+
+    -- arm -> trigger transition on *trg
+    smu.trigger.arm.stimulus = trigger.EVENT_ID
+
+    -- blender 1: source on entering the trigger layer or after each pulse
+    trigger.blender[1].orenable = true
+    trigger.blender[1].stimulus[1] = smu.trigger.ARMED_EVENT_ID
+    trigger.blender[1].stimulus[2] = smu.trigger.PULSE_COMPLETE_EVENT_ID
+    smu.trigger.source.stimulus = trigger.blender[1].EVENT_ID
+
+    -- blender 2: end the pulse once the measurement is complete
+    trigger.blender[2].orenable = true
+    trigger.blender[2].stimulus[1] = smu.trigger.MEASURE_COMPLETE_EVENT_ID
+    smu.trigger.endpulse.stimulus = trigger.blender[2].EVENT_ID
+
+    smu.source.output = smu.OUTPUT_ON
+
+    -- prepare SMU to wait for trigger
+    smu.trigger.initiate()
+end
+"""
+
+
+def _lua_one_line(script: str) -> str:
+    """
+    Strips ``--`` comments and joins a Lua script into a single line, since the
+    instrument executes every received line as a separate chunk.
+    """
+    lines = (line.split("--")[0].strip() for line in script.splitlines())
+    return " ".join(line for line in lines if line)
+
+
+def _lua_numbers(values: np.ndarray) -> str:
+    """
+    Formats a float array as comma separated Lua numbers. ``tolist`` converts the
+    whole array at once and ``repr`` round-trips every value exactly.
+    """
+    return ",".join(map(repr, values.tolist()))
+
+
+def sweep_steps(start: float, stop: float, step: float) -> np.ndarray:
+    """
+    Returns equidistant steps from ``start`` to ``stop``, both included. The step
+    size is adjusted to the nearest one dividing the range into whole steps.
+    Unlike ``np.arange`` with a float step, the end point is always reached.
+
+    :param start: First step.
+    :param stop: Last step.
+    :param step: Requested step size, its sign is ignored.
+    """
+    n = int(round(abs((stop - start) / step))) + 1
+    return np.linspace(start, stop, n, dtype=np.float64)
+
+
 class _Keithley2600Extend(Keithley2600):
+
+    _protected_attrs = [
+        "_srq_supported",
+        "_sweep_scripts_loaded",
+        "_sweep_fn_cache",
+        "_smu_name_cache",
+    ] + Keithley2600._protected_attrs
+
     def __init__(self, *args, **kwargs) -> None:
+        # None: not known yet, SRQ events are tried on the first sweep
+        self._srq_supported: Optional[bool] = None
+        self._sweep_scripts_loaded = False
+        # sweep settings -> name of the TSP wrapper function, see _define_sweep_function
+        self._sweep_fn_cache: Dict[Tuple, str] = {}
+        # full Lua name of an SMU -> short name, see _get_smu_name
+        self._smu_name_cache: Dict[str, str] = {}
         super(_Keithley2600Extend, self).__init__(*args, **kwargs)
+
+    def connect(self, **kwargs) -> bool:
+        # a new session may talk to a power cycled instrument without our functions
+        self._sweep_scripts_loaded = False
+        self._sweep_fn_cache = {}
+        return super(_Keithley2600Extend, self).connect(**kwargs)
+
+    def _load_sweep_scripts(self) -> None:
+        """
+        Defines the TSP functions ``tb_dual_sweep`` and ``tb_single_sweep`` on the
+        Keithley, once per connection.
+        """
+        if not self._sweep_scripts_loaded:
+            self._write(_lua_one_line(_DUAL_SWEEP_SCRIPT))
+            self._write(_lua_one_line(_SINGLE_SWEEP_SCRIPT))
+            self._sweep_scripts_loaded = True
+
+    def _get_smu_name(self, smu: KeithleyClass) -> str:
+        # validated once per SMU, also used by the sweeps of the base class
+        name = self._smu_name_cache.get(smu._name)
+        if name is None:
+            name = super(_Keithley2600Extend, self)._get_smu_name(smu)
+            self._smu_name_cache[smu._name] = name
+        return name
+
+    def _define_sweep_function(self, key: Tuple, generic: str, *args: str) -> str:
+        """
+        Defines a TSP function which calls the sweep function ``generic`` with the
+        fixed arguments ``args`` and takes only the number of points. Its name is
+        cached under ``key``, so that repeated sweeps with the same settings neither
+        resend the settings nor query the line frequency again.
+
+        :param key: Hashable sweep settings which determine ``args``.
+        :param generic: ``tb_dual_sweep`` or ``tb_single_sweep``.
+        :param args: Lua expressions of all arguments but ``npts``.
+        :returns: Name of the TSP function.
+        """
+        self._load_sweep_scripts()
+        name = f"{generic}_{len(self._sweep_fn_cache)}"
+        self._write(f"function {name}(npts) {generic}({', '.join(args)}, npts) end")
+        self._sweep_fn_cache[key] = name
+        return name
+
+    def _get_nplc(self, t_int: float) -> float:
+        """
+        Converts an integration time to power line cycles, see
+        :meth:`set_integration_time`.
+
+        :param t_int: Integration time in sec.
+        :raises: :class:`ValueError` for too short or too long integration times.
+        """
+        freq = self.localnode.linefreq
+        nplc = t_int * freq
+
+        if nplc < 0.001 or nplc > 25:
+            raise ValueError(
+                "Integration time must be between 0.001 and 25 "
+                f"power line cycles of 1/({freq} Hz)."
+            )
+        return float(nplc)
+
+    def _upload_sweeplist(self, name: str, sweeplist: np.ndarray) -> None:
+        """
+        Assigns the values of ``sweeplist`` to the global Lua table ``name`` on the
+        Keithley. Values are sent in blocks of ``CHUNK_SIZE`` per write instead of
+        one ``table.insert`` round-trip per value. The first block replaces the
+        previous table, so the global can be reused by every sweep and is neither
+        registered with nor deleted through the driver.
+
+        :param name: Name of the Lua table.
+        :param sweeplist: Float64 array of the values to upload.
+        """
+        chunk = _lua_numbers(sweeplist[:self.CHUNK_SIZE])
+        self._write(f"{name} = {{{chunk}}}")
+        for start in range(self.CHUNK_SIZE, sweeplist.size, self.CHUNK_SIZE):
+            chunk = _lua_numbers(sweeplist[start:start + self.CHUNK_SIZE])
+            self._write(f"for _, x in ipairs({{{chunk}}}) do table.insert({name}, x) end")
     
+    def _read_buffer_fast(self, buffer: KeithleyClass) -> np.ndarray:
+        """
+        Reads all buffer values with a single ``printbuffer`` query. :meth:`read_buffer`
+        instead queries every reading separately.
+
+        The readings are transferred as ASCII: binary REAL64 data may contain the
+        read termination character and would be cut short.
+
+        :param buffer: A keithley buffer instance.
+        :returns: Array with buffer readings.
+        """
+        n = int(buffer.n)
+        if n == 0:
+            return np.empty(0, dtype=np.float64)
+
+        return self._read_buffer_range(buffer, 1, n)
+
+    def _read_buffer_range(self, buffer: KeithleyClass, start: int, stop: int) -> np.ndarray:
+        """
+        Reads the buffer values ``start`` to ``stop`` (1-based, both included) with a
+        single ``printbuffer`` query, see :meth:`_read_buffer_fast`.
+
+        :param buffer: A keithley buffer instance.
+        :param start: Index of the first reading.
+        :param stop: Index of the last reading.
+        :returns: Array with buffer readings.
+        """
+        with self._lock:
+            if not self.connection:
+                raise KeithleyIOError(
+                    "No connection to keithley present. Try to call 'connect'."
+                )
+            response = self.connection.query(
+                "format.data = format.ASCII format.asciiprecision = 14 "
+                f"printbuffer({start}, {stop}, {buffer._name})"
+            )
+
+        return np.array(response.split(","), dtype=np.float64)
+
+    def _clear_buffers(self, *smus: KeithleyClass) -> None:
+        """
+        Clears both buffers and their caches of all given SMUs with a single write.
+
+        :param smus: Keithley smu instances.
+        """
+        self._write(" ".join(
+            f"{smu._name}.{buffer}.{method}()"
+            for smu in smus
+            for method in ("clear", "clearcache")
+            for buffer in ("nvbuffer1", "nvbuffer2")
+        ))
+
+    def _arm_sweep_srq(self, *smus: KeithleyClass) -> bool:
+        """
+        Configures the status model to request service once the SMUs stop sweeping
+        and enables SRQ events on the VISA session. Must be called before the sweep
+        is triggered.
+
+        :param smus: Keithley smu instances to be swept.
+        :returns: ``True`` if :meth:`_wait_for_sweep` can wait for the SRQ, ``False``
+            if the VISA session does not support events and the sweep status has
+            to be polled.
+        """
+        if self._srq_supported is False:
+            return False
+
+        try:
+            self.connection.enable_event(
+                visa_constants.EventType.service_request,
+                visa_constants.EventMechanism.queue,
+            )
+        except (VisaIOError, NotImplementedError):
+            logger.debug("SRQ events not supported, polling the sweep status instead.")
+            self._srq_supported = False
+            return False
+
+        self._srq_supported = True
+
+        # summarize the falling edge of the sweeping bits of the swept SMUs into
+        # the SRQ, a single channel instrument has no SMUB bit
+        mask = " + ".join(
+            f"status.operation.sweeping.{self._get_smu_name(smu).upper()}" for smu in smus
+        )
+        self._write(
+            "status.reset() "
+            "status.operation.sweeping.ptr = 0 "
+            f"status.operation.sweeping.ntr = {mask} "
+            f"status.operation.sweeping.enable = {mask} "
+            "status.operation.enable = status.operation.SWEEPING "
+            "status.request_enable = status.OSB"
+        )
+        return True
+
+    def _wait_for_sweep(self, srq: bool) -> bool:
+        """
+        Blocks until the triggered sweep has finished. Returns early if
+        ``abort_event`` is set while waiting for the SRQ, the SMUs may then
+        still be sweeping, see :meth:`_stop_sweep`.
+
+        :param srq: Return value of :meth:`_arm_sweep_srq`.
+        :returns: ``False`` if aborted, ``True`` once the sweep has finished.
+        """
+        if not srq:
+            # CHECK STATUS BUFFER FOR MEASUREMENT TO FINISH
+            # Possible return values:
+            # 6 = smua and smub sweeping
+            # 4 = only smub sweeping
+            # 2 = only smua sweeping
+            # 0 = neither smu sweeping
+
+            # while loop that runs until the sweep begins
+            while self.status.operation.sweeping.condition == 0:
+                time.sleep(0.1)
+
+            # while loop that runs until the sweep ends
+            while self.status.operation.sweeping.condition > 0:
+                time.sleep(0.1)
+            return True
+
+        event_type = visa_constants.EventType.service_request
+        try:
+            # short timeouts keep the abort event responsive
+            while not self.abort_event.is_set():
+                response = self.connection.wait_on_event(event_type, 250, capture_timeout=True)
+                if not response.timed_out:
+                    break
+                # the sweep is running by the first timeout; if it has ended
+                # without an SRQ, e.g. a firewalled VXI-11 interrupt channel,
+                # poll the sweep status from now on
+                if self.status.operation.sweeping.condition == 0:
+                    logger.warning("No SRQ at the end of the sweep, polling the sweep status instead.")
+                    self._srq_supported = False
+                    break
+        finally:
+            with self._lock:
+                self.connection.discard_events(event_type, visa_constants.EventMechanism.queue)
+                self.connection.disable_event(event_type, visa_constants.EventMechanism.queue)
+                self.connection.read_stb()  # clears the SRQ
+
+        if self.abort_event.is_set():
+            return False
+
+        # the SRQ is requested as soon as the first SMU stops sweeping
+        while self.status.operation.sweeping.condition > 0:
+            time.sleep(0.01)
+        return True
+
+    def _wait_for_sweep_live(
+        self,
+        smus: Sequence[KeithleyClass],
+        npts: int,
+        progress: Callable[..., None],
+    ) -> bool:
+        """
+        Blocks until the triggered sweep of ``smus`` has finished, like
+        :meth:`_wait_for_sweep`, and passes new readings to ``progress`` while
+        waiting. Returns early if ``abort_event`` is set.
+
+        :param smus: Keithley smu instances measuring into ``nvbuffer1``
+            (currents) and ``nvbuffer2`` (voltages).
+        :param npts: Number of points of the sweep, a sweep stopping with fewer
+            readings is logged.
+        :param progress: Called with the voltages and currents of the new points
+            of every SMU, in the order of ``smus``: ``(v_1, i_1, v_2, i_2, ...)``.
+        :returns: ``False`` if aborted, ``True`` once the sweep has finished.
+        """
+        buffers = [buffer for smu in smus for buffer in (smu.nvbuffer2, smu.nvbuffer1)]
+        read = 0
+        started = False
+        while not self.abort_event.is_set():
+            # checked before the buffers: once the sweep is seen stopped here,
+            # the buffers read below hold all of its readings
+            sweeping = self.status.operation.sweeping.condition > 0
+            # all buffers are filled by the same triggered measurements
+            n = min(int(buffer.n) for buffer in buffers)
+            started = started or sweeping or n > 0
+            if n > read:
+                new = [self._read_buffer_range(buffer, read + 1, n) for buffer in buffers]
+                read = n
+                progress(*new)
+            elif started and not sweeping:
+                # all readings of the finished sweep have been passed on
+                if read < npts:
+                    logger.warning(f"Sweep stopped after {read} of {npts} points.")
+                return True
+            else:
+                time.sleep(0.1)
+        return False
+
+    def _stop_sweep(self, *smus: KeithleyClass) -> None:
+        """
+        Stops the sweep of ``smus`` after an abort and waits until no SMU is
+        sweeping. The buffers are left as they are, the next sweep clears them.
+
+        :param smus: Keithley smu instances which were swept.
+        """
+        for smu in smus:
+            self._write(f"{smu._name}.abort()")
+        while self.status.operation.sweeping.condition > 0:
+            time.sleep(0.01)
+
     def current_voltage_sweep_dual_smu(
         self,
         smui: KeithleyClass,
@@ -41,7 +519,9 @@ class _Keithley2600Extend(Keithley2600):
         t_int: float,
         delay: float,
         pulsed: bool,
-    ) -> Tuple[List[float], List[float], List[float], List[float]]:
+        filter_count: int = 1,
+        progress: Optional[Callable[[np.ndarray, np.ndarray, np.ndarray, np.ndarray], None]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
         Sweeps voltages at two SMUs. Measures and returns current and voltage
         during sweep.
@@ -58,19 +538,29 @@ class _Keithley2600Extend(Keithley2600):
             automatically starts a measurement once the current is stable.
         :param pulsed: Select pulsed or continuous sweep. In a pulsed sweep, the voltage
             is always reset to zero between data points.
-        :returns: Lists of voltages and currents measured during the sweep (in
+        :param filter_count: Number of readings averaged per data point, between 1
+            and 100. A count of 1 leaves the filter settings of the instrument
+            unchanged.
+        :param progress: Optional method called with the voltages and currents of
+            new data points while the sweep runs, in the order of the returned
+            arrays. The readings are polled, the sweep does not wait for the method.
+        :returns: Arrays of voltages and currents measured during the sweep (in
             Volt and Ampere, respectively): ``(v_smui, i_smui, v_smuv,
             i_smuv)``.
         """
 
+        # coerce once, the lists are formatted as TSP tables below
+        smui_sweeplist = np.ascontiguousarray(smui_sweeplist, dtype=np.float64)
+        smuv_sweeplist = np.ascontiguousarray(smuv_sweeplist, dtype=np.float64)
+
         with self._measurement_lock:
 
-            if len(smui_sweeplist) != len(smuv_sweeplist):
+            if smui_sweeplist.size != smuv_sweeplist.size:
                 raise ValueError("Sweep lists must have equal lengths")
 
-            # Define lists containing results.
+            # Define arrays containing results.
             # If we abort early, we have something to return.
-            v_smui, i_smui, v_smuv, i_smuv = [], [], [], []
+            v_smui = i_smui = v_smuv = i_smuv = np.empty(0, dtype=np.float64)
 
             if self.abort_event.is_set():
                 return v_smui, i_smui, v_smuv, i_smuv
@@ -79,92 +569,17 @@ class _Keithley2600Extend(Keithley2600):
 
             # setup smui and smuv to sweep through lists on trigger
             # send sweep_list over in chunks if too long
-            if len(smui_sweeplist) > self.CHUNK_SIZE:
-                self.create_lua_attr("python_driver_list", [])
-                for num in smui_sweeplist:
-                    self.table.insert(self.python_driver_list, num)
-                smui.trigger.source.listi(self.python_driver_list)
-                self.delete_lua_attr("python_driver_list")
+            if smui_sweeplist.size > self.CHUNK_SIZE:
+                self._upload_sweeplist("python_driver_list_i", smui_sweeplist)
+                self._write(f"{smui._name}.trigger.source.listi(python_driver_list_i)")
             else:
-                smui.trigger.source.listi(smui_sweeplist)
-
-            if len(smuv_sweeplist) > self.CHUNK_SIZE:
-                self.create_lua_attr("python_driver_list", [])
-                for num in smuv_sweeplist:
-                    self.table.insert(self.python_driver_list, num)
-                smuv.trigger.source.listv(self.python_driver_list)
-                self.delete_lua_attr("python_driver_list")
-            else:
-                smuv.trigger.source.listv(smuv_sweeplist)
-
-            smui.trigger.source.action = smui.ENABLE
-            smuv.trigger.source.action = smuv.ENABLE
-
-            # CONFIGURE INTEGRATION TIME FOR EACH MEASUREMENT
-            self.set_integration_time(smui, t_int)
-            self.set_integration_time(smuv, t_int)
-
-            # CONFIGURE SETTLING TIME FOR GATE VOLTAGE, I-LIMIT, ETC...
-            smui.measure.delay = delay
-            smuv.measure.delay = delay
-
-            # enable autorange if not in high capacitance mode
-            if smui.source.highc == smui.DISABLE: # JJ: not sure if this option is correct for current source
-                smui.measure.autorangev = smui.AUTORANGE_ON
-            if smuv.source.highc == smuv.DISABLE:
-                smuv.measure.autorangei = smuv.AUTORANGE_ON
-
-            # smui.trigger.source.limiti = 0.1
-            # smuv.trigger.source.limiti = 0.1
+                self._write(f"{smui._name}.trigger.source.listi({{{_lua_numbers(smui_sweeplist)}}})")
 
-            smui.source.func = smui.OUTPUT_DCAMPS
-            smuv.source.func = smuv.OUTPUT_DCVOLTS
-
-            # 2-wire measurement (use SENSE_REMOTE for 4-wire)
-            # smui.sense = smui.SENSE_LOCAL
-            # smuv.sense = smuv.SENSE_LOCAL
-
-            # CLEAR BUFFERS
-            for smu in [smui, smuv]:
-                smu.nvbuffer1.clear()
-                smu.nvbuffer2.clear()
-                smu.nvbuffer1.clearcache()
-                smu.nvbuffer2.clearcache()
-
-            # display current values during measurement
-            # for smu in (smui, smuv):
-                # smu_name = self._get_smu_name(smu)
-                # getattr(self.display, smu_name).measure.func = self.display.MEASURE_DCAMPS
-            getattr(self.display, self._get_smu_name(smui)).measure.func = self.display.MEASURE_DCVOLTS
-            getattr(self.display, self._get_smu_name(smuv)).measure.func = self.display.MEASURE_DCAMPS
-
-            # SETUP TRIGGER ARM AND COUNTS
-            # trigger count = number of data points in measurement
-            # arm count = number of times the measurement is repeated (set to 1)
-
-            npts = len(smui_sweeplist)
-
-            smui.trigger.count = npts
-            smuv.trigger.count = npts
-
-            # SET THE MEASUREMENT TRIGGER ON BOTH SMU'S
-            # Set measurement to trigger once a change in the gate value on
-            # sweep smu is complete, i.e., a measurement will occur
-            # after the voltage is stepped.
-            # Both channels should be set to trigger on the sweep smu event
-            # so the measurements occur at the same time.
-
-            # enable smu
-            smui.trigger.measure.action = smui.ENABLE
-            smuv.trigger.measure.action = smuv.ENABLE
-
-            # measure current and voltage on trigger, store in buffer of smu
-            smui.trigger.measure.iv(smui.nvbuffer1, smui.nvbuffer2)
-            smuv.trigger.measure.iv(smuv.nvbuffer1, smuv.nvbuffer2)
-
-            # initiate measure trigger when source is complete
-            smui.trigger.measure.stimulus = smui.trigger.SOURCE_COMPLETE_EVENT_ID
-            smuv.trigger.measure.stimulus = smui.trigger.SOURCE_COMPLETE_EVENT_ID
+            if smuv_sweeplist.size > self.CHUNK_SIZE:
+                self._upload_sweeplist("python_driver_list_v", smuv_sweeplist)
+                self._write(f"{smuv._name}.trigger.source.listv(python_driver_list_v)")
+            else:
+                self._write(f"{smuv._name}.trigger.source.listv({{{_lua_numbers(smuv_sweeplist)}}})")
 
             # SET THE ENDPULSE ACTION TO HOLD
             # Options are SOURCE_HOLD AND SOURCE_IDLE, hold maintains same voltage
@@ -178,94 +593,233 @@ class _Keithley2600Extend(Keithley2600):
             else:
                 raise TypeError("'pulsed' must be of type 'bool'.")
 
-            smui.trigger.endpulse.action = end_pulse_action
-            smuv.trigger.endpulse.action = end_pulse_action
-
-            # SET THE ENDSWEEP ACTION TO HOLD IF NOT PULSED
-            # Output voltage will be held after sweep is done!
-
-            smui.trigger.endsweep.action = end_pulse_action
-            smuv.trigger.endsweep.action = end_pulse_action
-
-            # SET THE EVENT TO TRIGGER THE SMU'S TO THE ARM LAYER
-            # A typical measurement goes from idle -> arm -> trigger.
-            # The 'trigger.event_id' option sets the transition arm -> trigger
-            # to occur after sending *trg to the instrument.
-
-            smui.trigger.arm.stimulus = self.trigger.EVENT_ID
-
-            # Prepare an event blender (blender #1) that triggers when
-            # the smua enters the trigger layer or reaches the end of a
-            # single trigger layer cycle.
-
-            # triggers when either of the stimuli are true ('or enable')
-            self.trigger.blender[1].orenable = True
-            self.trigger.blender[1].stimulus[1] = smui.trigger.ARMED_EVENT_ID
-            self.trigger.blender[1].stimulus[2] = smui.trigger.PULSE_COMPLETE_EVENT_ID
-
-            # SET THE smui SOURCE STIMULUS TO BE EVENT BLENDER #1
-            # A source measure cycle within the trigger layer will occur when
-            # either the trigger layer is entered (termed 'armed event') for the
-            # first time or a single cycle of the trigger layer is complete (termed
-            # 'pulse complete event').
+            filter_count = int(filter_count)
+            if not 1 <= filter_count <= 100:
+                raise ValueError("Filter count must be between 1 and 100.")
+
+            # configure the trigger model and start both SMUs in a single
+            # write, see _DUAL_SWEEP_SCRIPT
+            key = ("dual", smui._name, smuv._name, float(t_int), float(delay), filter_count, end_pulse_action)
+            sweep_fn = self._sweep_fn_cache.get(key) or self._define_sweep_function(
+                key,
+                "tb_dual_sweep",
+                smui._name,
+                smuv._name,
+                f"display.{self._get_smu_name(smui)}",
+                f"display.{self._get_smu_name(smuv)}",
+                repr(self._get_nplc(t_int)),
+                repr(float(delay)),
+                str(filter_count),
+                str(end_pulse_action),
+            )
+            self._write(f"{sweep_fn}({smui_sweeplist.size})")
 
-            smui.trigger.source.stimulus = self.trigger.blender[1].EVENT_ID
+            # send trigger and wait for the sweep to finish
+            if progress is None:
+                srq = self._arm_sweep_srq(smui, smuv)
+                self.send_trigger()
+                finished = self._wait_for_sweep(srq)
+            else:
+                self.send_trigger()
+                finished = self._wait_for_sweep_live((smui, smuv), smui_sweeplist.size, progress)
 
-            # PREPARE AN EVENT BLENDER (blender #2) THAT TRIGGERS WHEN BOTH SMU'S
-            # HAVE COMPLETED A MEASUREMENT.
-            # This is needed to prevent the next source measure cycle from occurring
-            # before the measurement on both channels is complete.
+            if not finished:
+                # reading and clearing the buffers would race the sweep
+                self._stop_sweep(smui, smuv)
+                return v_smui, i_smui, v_smuv, i_smuv
 
-            self.trigger.blender[2].orenable = False  # triggers when both stimuli are true
-            self.trigger.blender[2].stimulus[1] = smui.trigger.MEASURE_COMPLETE_EVENT_ID
-            self.trigger.blender[2].stimulus[2] = smuv.trigger.MEASURE_COMPLETE_EVENT_ID
+            # EXTRACT DATA FROM SMU BUFFERS
+            i_smui = self._read_buffer_fast(smui.nvbuffer1)
+            v_smui = self._read_buffer_fast(smui.nvbuffer2)
+            i_smuv = self._read_buffer_fast(smuv.nvbuffer1)
+            v_smuv = self._read_buffer_fast(smuv.nvbuffer2)
 
-            # SET THE smui ENDPULSE STIMULUS TO BE EVENT BLENDER #2
-            smui.trigger.endpulse.stimulus = self.trigger.blender[2].EVENT_ID
+            # CLEAR BUFFERS
+            self._clear_buffers(smui, smuv)
 
-            # TURN ON smui AND smuv
-            smui.source.output = smui.OUTPUT_ON
-            smuv.source.output = smuv.OUTPUT_ON
+            return v_smui, i_smui, v_smuv, i_smuv
+    
+    
+    @staticmethod
+    def _fwd_rvs_sweeplist(start: float, stop: float, step: float) -> np.ndarray:
+        """
+        Returns the steps of :func:`sweep_steps` followed by the same steps in reverse.
+        """
+        fwd = sweep_steps(start, stop, step)
+        n_fwd = fwd.size
+        sweeplist = np.empty(2 * n_fwd, dtype=np.float64)
+        sweeplist[:n_fwd] = fwd
+        sweeplist[n_fwd:] = fwd[::-1]
+        return sweeplist
+
+    def _outer_sweep(
+        self,
+        sweep,
+        smu_gate: KeithleyClass,
+        smu_drain: KeithleyClass,
+        sweeplist: np.ndarray,
+        sweep_gate: bool,
+        outer_list: np.ndarray,
+        columns: Tuple[str, ...],
+        extra_values: Tuple[np.ndarray, ...],
+        t_int: float,
+        delay: float,
+        pulsed: bool,
+        callback,
+        label: str,
+        out_path: Optional[str] = None,
+        progress=None,
+    ) -> Union[DataFrame, str]:
+        """
+        Common loop of :meth:`transfer_measurement_i`, :meth:`transfer_measurement_v`
+        and :meth:`iv_measurement_v`: runs ``sweep`` once for every value of
+        ``outer_list``, which is held constant at the other SMU.
+
+        :param sweep: Sweep method with the signature of
+            :meth:`current_voltage_sweep_dual_smu`, called with the drain SMU first.
+        :param sweeplist: Steps swept during each sweep.
+        :param sweep_gate: ``True`` if ``sweeplist`` is swept at the gate and the
+            outer values are applied to the drain, ``False`` for the reverse.
+        :param outer_list: Values held constant during one sweep each.
+        :param columns: Column names: gate and drain setpoint, one per array of
+            ``extra_values``, then ``'Vg', 'Ig', 'Vd', 'Id'``.
+        :param extra_values: Further columns following the setpoint columns.
+        :param label: Name of the outer value in log messages.
+        :param callback: Called with the outer value and the data of every sweep,
+            from a worker thread.
+        :param out_path: If given, the data of every sweep is appended to this
+            Parquet file instead of being kept in memory. Requires pyarrow.
+        :param progress: Called with the outer value and the data of new points
+            while a sweep runs, from the measurement thread. ``sweep`` must then
+            accept a ``progress`` argument like :meth:`current_voltage_sweep_dual_smu`.
+        :returns: Data of all completed sweeps, or ``out_path`` if given.
+        """
+        frames = []
+
+        if out_path is not None:
+            # optional dependency, only needed for streaming
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        writer = None
+
+        def consume(value, _df):
+            # runs in the worker thread, never touches the instrument
+            nonlocal writer
+            if out_path is not None:
+                # one row group per sweep
+                table = pa.Table.from_pandas(_df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_path, table.schema)
+                writer.write_table(table)
+
+            if callback is not None:
+                callback(value, _df)
+
+        # writing and the callback overlap with the next sweep
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = []
+
+        # outer setpoints, refilled for every outer step
+        sweeplist_outer = np.empty_like(sweeplist)
+        if sweep_gate:
+            sweeplist_drain, sweeplist_gate = sweeplist_outer, sweeplist
+        else:
+            sweeplist_drain, sweeplist_gate = sweeplist, sweeplist_outer
+
+        def frame(start, v_d, i_d, v_g, i_g):
+            # data of the sweep points from index start on
+            stop = start + len(v_d)
+            # voltage_sweep_dual_smu returns lists, pass float64 arrays so that
+            # pandas does not have to infer the column types
+            d = dict(zip(columns, (
+                sweeplist_gate[start:stop],
+                sweeplist_drain[start:stop],
+                *(values[start:stop] for values in extra_values),
+                np.asarray(v_g, dtype=np.float64),
+                np.asarray(i_g, dtype=np.float64),
+                np.asarray(v_d, dtype=np.float64),
+                np.asarray(i_d, dtype=np.float64),
+            )))
+            # built here since the sweep lists are refilled by the next step
+            return pd.DataFrame(data=d, index=pd.RangeIndex(start, stop))
+
+        read = 0
+
+        def sweep_progress(v_d, i_d, v_g, i_g):
+            # called by the sweep with the points measured since the last call
+            nonlocal read
+            _df = frame(read, v_d, i_d, v_g, i_g)
+            read = _df.index.stop
+            progress(value, _df)
+
+        progress_kwargs = {} if progress is None else {"progress": sweep_progress}
+
+        try:
+            # record sweeps for every outer step
+            for value in outer_list:
+                logger.info(f"{label} = {value}")
 
-            # INITIATE MEASUREMENT
-            # prepare SMUs to wait for trigger
-            smui.trigger.initiate()
-            smuv.trigger.initiate()
+                # check for abort event
+                if self.abort_event.is_set():
+                    with self._measurement_lock:
+                        self.reset()
+                        self.beeper.beep(0.3, 2400)
+                    break
 
-            # send trigger
-            self.send_trigger()
+                sweeplist_outer.fill(value)
+                read = 0
 
-            # CHECK STATUS BUFFER FOR MEASUREMENT TO FINISH
-            # Possible return values:
-            # 6 = smua and smub sweeping
-            # 4 = only smub sweeping
-            # 2 = only smua sweeping
-            # 0 = neither smu sweeping
+                # conduct sweep
+                v_d, i_d, v_g, i_g = sweep(
+                    smu_drain,
+                    smu_gate,
+                    sweeplist_drain,
+                    sweeplist_gate,
+                    t_int,
+                    delay,
+                    pulsed,
+                    **progress_kwargs,
+                )
 
-            # while loop that runs until the sweep begins
-            while self.status.operation.sweeping.condition == 0:
-                time.sleep(0.1)
+                if not self.abort_event.is_set():
+                    _df = frame(0, v_d, i_d, v_g, i_g)
 
-            # while loop that runs until the sweep ends
-            while self.status.operation.sweeping.condition > 0:
-                time.sleep(0.1)
+                    if out_path is None:
+                        frames.append(_df)
+                    if out_path is not None or callback is not None:
+                        pending.append(executor.submit(consume, value, _df))
+            else:
+                with self._measurement_lock:
+                    self.reset()
 
-            # EXTRACT DATA FROM SMU BUFFERS
-            i_smui = self.read_buffer(smui.nvbuffer1)
-            v_smui = self.read_buffer(smui.nvbuffer2)
-            i_smuv = self.read_buffer(smuv.nvbuffer1)
-            v_smuv = self.read_buffer(smuv.nvbuffer2)
+            # raise errors of the callback or writer
+            for future in pending:
+                future.result()
+        finally:
+            executor.shutdown(wait=True)
+            if writer is not None:
+                writer.close()
+
+        if not frames and writer is None:
+            # no sweep completed, typed empty columns instead of object columns
+            empty = np.empty(0, dtype=np.float64)
+            frames.append(pd.DataFrame(dict(zip(columns, (
+                empty,
+                empty,
+                *(values[:0] for values in extra_values),
+                empty,
+                empty,
+                empty,
+                empty,
+            )))))
+
+        if out_path is not None:
+            if writer is None:
+                pq.write_table(pa.Table.from_pandas(frames[0], preserve_index=False), out_path)
+            return out_path
+        return pd.concat(frames, ignore_index=False)
 
-            # CLEAR BUFFERS
-            for smu in [smui, smuv]:
-                smu.nvbuffer1.clear()
-                smu.nvbuffer2.clear()
-                smu.nvbuffer1.clearcache()
-                smu.nvbuffer2.clearcache()
 
-            return v_smui, i_smui, v_smuv, i_smuv
-    
-    
     def transfer_measurement_i(
         self,
         smu_gate: KeithleyClass,
@@ -277,8 +831,11 @@ class _Keithley2600Extend(Keithley2600):
         t_int: float,
         delay: float,
         pulsed: bool,
-        callback = None
-    ) -> DataFrame:
+        callback = None,
+        out_path: Optional[str] = None,
+        filter_count: int = 1,
+        progress = None,
+    ) -> Union[DataFrame, str]:
         """
         Records a transfer curve with forward and reverse gate sweeps for given drain currents and returns the results
         in a :class:`pandas.DataFrame` instance.
@@ -297,8 +854,17 @@ class _Keithley2600Extend(Keithley2600):
         :param bool pulsed: Select pulsed or continuous sweep. In a pulsed sweep, the
             voltage is always reset to zero between data points.
         :param method(idrain:float, df:DataFrame) callback: Callback method invoked after 
-            each gate sweep. Argument: dataframe with transfer curve data.
-        :returns: Transfer curve data.
+            each gate sweep. Argument: dataframe with transfer curve data. Runs in a
+            worker thread while the next sweep is recorded.
+        :param out_path: Optional path of a Parquet file. If given, the data of every
+            sweep is appended to it instead of being kept in memory. Requires pyarrow.
+        :param filter_count: Number of readings averaged per data point, between 1
+            and 100. A count of 1 leaves the filter settings of the instrument
+            unchanged.
+        :param method(idrain:float, df:DataFrame) progress: Optional method invoked
+            with the data of new points while a gate sweep runs, indexed by their
+            position in the sweep. Runs in the measurement thread.
+        :returns: Transfer curve data, or ``out_path`` if given.
         """
 
         vg_start = float(vg_start)
@@ -306,69 +872,32 @@ class _Keithley2600Extend(Keithley2600):
         vg_step = float(vg_step)
         id_list = np.array(id_list, dtype=np.double)
         
-        with self._measurement_lock:
-
-            self.abort_event.clear()
-
-            msg = f"Recording transfer curve with Vg from {vg_start}V to {vg_stop}V, Id = {id_list}A."
-            logger.info(msg)
-
-            # create array with gate voltage steps, always include a step >= VgStop
-            step = np.sign(vg_stop - vg_start) * abs(vg_step)
-            sweeplist_gate_fwd = np.arange(vg_start, vg_stop + step, step)
-            sweeplist_gate_rvs = np.flip(sweeplist_gate_fwd, 0)
-            sweeplist_gate = np.append(sweeplist_gate_fwd, sweeplist_gate_rvs)
-            
-            direction_gate_fwd = np.append(
-                np.ones_like(sweeplist_gate_fwd, dtype=int),
-                np.zeros_like(sweeplist_gate_rvs, dtype=int)
-            )
-
-            rt = pd.DataFrame(columns=['Vg_SP', 'Id_SP', 'Vg', 'Ig', 'Vd', 'Id'])
-
-            # record sweeps for every drain voltage step
-            for idrain in id_list:
-                logger.info(f"idrain = {idrain}")
-                
-                # check for abort event
-                if self.abort_event.is_set():
-                    self.reset()
-                    self.beeper.beep(0.3, 2400)
-                    return rt
-
-                # create array with drain currents
-                sweeplist_drain = np.full_like(sweeplist_gate, idrain)
-
-                # conduct sweep
-                v_d, i_d, v_g, i_g = self.current_voltage_sweep_dual_smu(
-                    smu_drain,
-                    smu_gate,
-                    sweeplist_drain,
-                    sweeplist_gate,
-                    t_int,
-                    delay,
-                    pulsed,
-                )
-
-                if not self.abort_event.is_set():
-                    d = {
-                        'Vg_SP': sweeplist_gate, 
-                        'Id_SP': sweeplist_drain, 
-                        'Vg_dir_fwd': direction_gate_fwd,
-                        'Vg':v_g, 
-                        'Ig':i_g, 
-                        'Vd':v_d, 
-                        'Id':i_d
-                    }
-                    _df = pd.DataFrame(data=d)
-                    rt = pd.concat([rt, _df], ignore_index=False)
-                    
-                    if callback is not None:
-                        callback(idrain, _df)
-                    
-            self.reset()
-
-            return rt
+        self.abort_event.clear()
+
+        msg = f"Recording transfer curve with Vg from {vg_start}V to {vg_stop}V, Id = {id_list}A."
+        logger.info(msg)
+
+        sweeplist_gate = self._fwd_rvs_sweeplist(vg_start, vg_stop, vg_step)
+        direction_gate_fwd = np.zeros(sweeplist_gate.size, dtype=int)
+        direction_gate_fwd[:sweeplist_gate.size // 2] = 1
+
+        return self._outer_sweep(
+            partial(self.current_voltage_sweep_dual_smu, filter_count=filter_count),
+            smu_gate,
+            smu_drain,
+            sweeplist_gate,
+            True,
+            id_list,
+            _TRANSFER_I_COLUMNS,
+            (direction_gate_fwd,),
+            t_int,
+            delay,
+            pulsed,
+            callback,
+            "idrain",
+            out_path,
+            progress,
+        )
 
 
     def transfer_measurement_v(
@@ -382,8 +911,9 @@ class _Keithley2600Extend(Keithley2600):
         t_int: float,
         delay: float,
         pulsed: bool,
-        callback = None
-    ) -> DataFrame:
+        callback = None,
+        out_path: Optional[str] = None,
+    ) -> Union[DataFrame, str]:
         """
         Records a transfer curve with forward and reverse gate voltage sweeps for given drain voltage and returns the results
         in a :class:`pandas.DataFrame` instance.
@@ -402,8 +932,11 @@ class _Keithley2600Extend(Keithley2600):
         :param bool pulsed: Select pulsed or continuous sweep. In a pulsed sweep, the
             voltage is always reset to zero between data points.
         :param method(vdrain:float, df:DataFrame) callback: Callback method invoked after 
-            each gate sweep. Argument: dataframe with transfer curve data.
-        :returns: Transfer curve data.
+            each gate sweep. Argument: dataframe with transfer curve data. Runs in a
+            worker thread while the next sweep is recorded.
+        :param out_path: Optional path of a Parquet file. If given, the data of every
+            sweep is appended to it instead of being kept in memory. Requires pyarrow.
+        :returns: Transfer curve data, or ``out_path`` if given.
         """
 
         vg_start = float(vg_start)
@@ -411,59 +944,27 @@ class _Keithley2600Extend(Keithley2600):
         vg_step = float(vg_step)
         vd_list = np.array(vd_list, dtype=np.double)
         
-        with self._measurement_lock:
-
-            self.abort_event.clear()
-
-            msg = f"Recording transfer curve with Vg from {vg_start}V to {vg_stop}V, Vd = {vd_list}V."
-            logger.info(msg)
-
-            # create array with gate voltage steps, always include a step >= VgStop
-            step = np.sign(vg_stop - vg_start) * abs(vg_step)
-            sweeplist_gate_fwd = np.arange(vg_start, vg_stop + step, step)
-            sweeplist_gate_rvs = np.flip(sweeplist_gate_fwd, 0)
-            sweeplist_gate = np.append(sweeplist_gate_fwd, sweeplist_gate_rvs)
-
-            rt = pd.DataFrame(columns=['Vg_SP', 'Vd_SP', 'Vg', 'Ig', 'Vd', 'Id'])
-
-            # record sweeps for every drain voltage step
-            for vdrain in vd_list:
-                logger.info(f"vdrain = {vdrain}")
-                
-                # check for abort event
-                if self.abort_event.is_set():
-                    self.reset()
-                    self.beeper.beep(0.3, 2400)
-                    return rt
-
-                # create array with drain currents
-                sweeplist_drain = np.full_like(sweeplist_gate, vdrain)
-
-                # conduct sweep
-                v_d, i_d, v_g, i_g = self.voltage_sweep_dual_smu(
-                    smu_drain,
-                    smu_gate,
-                    sweeplist_drain,
-                    sweeplist_gate,
-                    t_int,
-                    delay,
-                    pulsed,
-                )
-
-                if not self.abort_event.is_set():
-                    d = {
-                        'Vg_SP': sweeplist_gate, 'Vd_SP': sweeplist_drain, 
-                        'Vg':v_g, 'Ig':i_g, 'Vd':v_d, 'Id':i_d
-                    }
-                    _df = pd.DataFrame(data=d)
-                    rt = pd.concat([rt, _df], ignore_index=False)
-                    
-                    if callback is not None:
-                        callback(vdrain, _df)
-                    
-            self.reset()
-
-            return rt
+        self.abort_event.clear()
+
+        msg = f"Recording transfer curve with Vg from {vg_start}V to {vg_stop}V, Vd = {vd_list}V."
+        logger.info(msg)
+
+        return self._outer_sweep(
+            self.voltage_sweep_dual_smu,
+            smu_gate,
+            smu_drain,
+            self._fwd_rvs_sweeplist(vg_start, vg_stop, vg_step),
+            True,
+            vd_list,
+            _TRANSFER_V_COLUMNS,
+            (),
+            t_int,
+            delay,
+            pulsed,
+            callback,
+            "vdrain",
+            out_path,
+        )
 
 
     def iv_measurement_v(
@@ -477,8 +978,9 @@ class _Keithley2600Extend(Keithley2600):
         t_int: float,
         delay: float,
         pulsed: bool,
-        callback = None
-    ) -> DataFrame:
+        callback = None,
+        out_path: Optional[str] = None,
+    ) -> Union[DataFrame, str]:
         """
         Records IV curves with drain voltage sweeps for given gate voltages and returns the results
         in a :class:`pandas.DataFrame` instance.
@@ -497,8 +999,11 @@ class _Keithley2600Extend(Keithley2600):
         :param bool pulsed: Select pulsed or continuous sweep. In a pulsed sweep, the
             voltage is always reset to zero between data points.
         :param method(vgate:float, df:DataFrame) callback: Callback method invoked after 
-            each gate sweep. Argument: dataframe with transfer curve data.
-        :returns: Transfer curve data.
+            each gate sweep. Argument: dataframe with transfer curve data. Runs in a
+            worker thread while the next sweep is recorded.
+        :param out_path: Optional path of a Parquet file. If given, the data of every
+            sweep is appended to it instead of being kept in memory. Requires pyarrow.
+        :returns: Transfer curve data, or ``out_path`` if given.
         """
 
         vd_start = float(vd_start)
@@ -506,57 +1011,27 @@ class _Keithley2600Extend(Keithley2600):
         vd_step = float(vd_step)
         vg_list = np.array(vg_list, dtype=np.double)
         
-        with self._measurement_lock:
-
-            self.abort_event.clear()
-
-            msg = f"Recording iv curve with Vd from {vd_start}V to {vd_stop}V, Vg = {vg_list}V."
-            logger.info(msg)
-
-            # create array with gate voltage steps, always include a step >= VgStop
-            step = np.sign(vd_stop - vd_start) * abs(vd_step)
-            sweeplist_drain = np.arange(vd_start, vd_stop + step, step)
-
-            rt = pd.DataFrame(columns=['Vg_SP', 'Vd_SP', 'Vg', 'Ig', 'Vd', 'Id'])
-
-            # record sweeps for every gate voltage step
-            for vgate in vg_list:
-                logger.info(f"vgate = {vgate}")
-                
-                # check for abort event
-                if self.abort_event.is_set():
-                    self.reset()
-                    self.beeper.beep(0.3, 2400)
-                    return rt
-
-                # create array with drain currents
-                sweeplist_gate = np.full_like(sweeplist_drain, vgate)
-
-                # conduct sweep
-                v_d, i_d, v_g, i_g = self.voltage_sweep_dual_smu(
-                    smu_drain,
-                    smu_gate,
-                    sweeplist_drain,
-                    sweeplist_gate,
-                    t_int,
-                    delay,
-                    pulsed,
-                )
-
-                if not self.abort_event.is_set():
-                    d = {
-                        'Vg_SP': sweeplist_gate, 'Vd_SP': sweeplist_drain, 
-                        'Vg':v_g, 'Ig':i_g, 'Vd':v_d, 'Id':i_d
-                    }
-                    _df = pd.DataFrame(data=d)
-                    rt = pd.concat([rt, _df], ignore_index=False)
-                    
-                    if callback is not None:
-                        callback(vgate, _df)
-                    
-            self.reset()
-
-            return rt
+        self.abort_event.clear()
+
+        msg = f"Recording iv curve with Vd from {vd_start}V to {vd_stop}V, Vg = {vg_list}V."
+        logger.info(msg)
+
+        return self._outer_sweep(
+            self.voltage_sweep_dual_smu,
+            smu_gate,
+            smu_drain,
+            sweep_steps(vd_start, vd_stop, vd_step),
+            False,
+            vg_list,
+            _IV_V_COLUMNS,
+            (),
+            t_int,
+            delay,
+            pulsed,
+            callback,
+            "vgate",
+            out_path,
+        )
 
 
     def current_sweep_single_smu(
@@ -566,7 +1041,9 @@ class _Keithley2600Extend(Keithley2600):
         t_int: float,
         delay: float,
         pulsed: bool,
-    ) -> Tuple[List[float], List[float]]:
+        filter_count: int = 1,
+        progress: Optional[Callable[[np.ndarray, np.ndarray], None]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Sweeps the current through the specified list of steps at the given
         SMU. Measures and returns the current and voltage during the sweep.
@@ -580,82 +1057,35 @@ class _Keithley2600Extend(Keithley2600):
             automatically starts a measurement once the current is stable.
         :param pulsed: Select pulsed or continuous sweep. In a pulsed sweep, the current
             is always reset to zero between data points.
-        :returns: Lists of voltages and currents measured during the sweep (in
+        :param filter_count: Number of readings averaged per data point, between 1
+            and 100. A count of 1 leaves the filter settings of the instrument
+            unchanged.
+        :param progress: Optional method called with the voltages and currents of
+            new data points while the sweep runs. The readings are polled, the
+            sweep does not wait for the method.
+        :returns: Arrays of voltages and currents measured during the sweep (in
             Volt and Ampere, respectively): ``(v_smu, i_smu)``.
         """
 
+        # coerce once, the list is formatted as TSP table below
+        smu_sweeplist = np.ascontiguousarray(smu_sweeplist, dtype=np.float64)
+
         with self._measurement_lock:
 
-            # Define lists containing results.
+            # Define arrays containing results.
             # If we abort early, we have something to return.
-            v_smu, i_smu = [], []
+            v_smu = i_smu = np.empty(0, dtype=np.float64)
 
             if self.abort_event.is_set():
                 return v_smu, i_smu
 
             # setup smu to sweep through list on trigger
             # send sweep_list over in chunks if too long
-            if len(smu_sweeplist) > self.CHUNK_SIZE:
-                self.create_lua_attr("python_driver_list", [])
-                for num in smu_sweeplist:
-                    self.table.insert(self.python_driver_list, num)
-                smu.trigger.source.listi(self.python_driver_list)
-                self.delete_lua_attr("python_driver_list")
+            if smu_sweeplist.size > self.CHUNK_SIZE:
+                self._upload_sweeplist("python_driver_list_i", smu_sweeplist)
+                self._write(f"{smu._name}.trigger.source.listi(python_driver_list_i)")
             else:
-                smu.trigger.source.listi(smu_sweeplist)
-
-            smu.trigger.source.action = smu.ENABLE
-
-            # CONFIGURE INTEGRATION TIME FOR EACH MEASUREMENT
-            self.set_integration_time(smu, t_int)
-
-            # CONFIGURE SETTLING TIME FOR GATE VOLTAGE, I-LIMIT, ETC...
-            smu.measure.delay = delay
-
-            # enable autorange if not in high capacitance mode
-            if smu.source.highc == smu.DISABLE:
-                smu.measure.autorangei = smu.AUTORANGE_ON
-
-            # smu.trigger.source.limiti = 0.1
-
-            smu.source.func = smu.OUTPUT_DCAMPS
-
-            # 2-wire measurement (use SENSE_REMOTE for 4-wire)
-            # smu.sense = smu.SENSE_LOCAL
-
-            # clears SMU buffers
-            smu.nvbuffer1.clear()
-            smu.nvbuffer2.clear()
-
-            smu.nvbuffer1.clearcache()
-            smu.nvbuffer2.clearcache()
-
-            # display current values during measurement
-            smu_name = self._get_smu_name(smu)
-            getattr(self.display, smu_name).measure.func = self.display.MEASURE_DCVOLTS
-
-            # SETUP TRIGGER ARM AND COUNTS
-            # trigger count = number of data points in measurement
-            # arm count = number of times the measurement is repeated (set to 1)
-
-            npts = len(smu_sweeplist)
-            smu.trigger.count = npts
-
-            # SET THE MEASUREMENT TRIGGER ON BOTH SMU'S
-            # Set measurement to trigger once a change in the gate value on
-            # sweep smu is complete, i.e., a measurement will occur
-            # after the voltage is stepped.
-            # Both channels should be set to trigger on the sweep smu event
-            # so the measurements occur at the same time.
-
-            # enable smu
-            smu.trigger.measure.action = smu.ENABLE
-
-            # measure current and voltage on trigger, store in buffer of smu
-            smu.trigger.measure.iv(smu.nvbuffer1, smu.nvbuffer2)
-
-            # initiate measure trigger when source is complete
-            smu.trigger.measure.stimulus = smu.trigger.SOURCE_COMPLETE_EVENT_ID
+                self._write(f"{smu._name}.trigger.source.listi({{{_lua_numbers(smu_sweeplist)}}})")
 
             # SET THE ENDPULSE ACTION TO HOLD
             # Options are SOURCE_HOLD AND SOURCE_IDLE, hold maintains same voltage
@@ -669,89 +1099,54 @@ class _Keithley2600Extend(Keithley2600):
             else:
                 raise TypeError("'pulsed' must be of type 'bool'.")
 
-            smu.trigger.endpulse.action = end_pulse_action
-
-            # SET THE ENDSWEEP ACTION TO HOLD IF NOT PULSED
-            # Output voltage will be held after sweep is done!
-
-            smu.trigger.endsweep.action = end_pulse_action
-
-            # SET THE EVENT TO TRIGGER THE SMU'S TO THE ARM LAYER
-            # A typical measurement goes from idle -> arm -> trigger.
-            # The 'trigger.event_id' option sets the transition arm -> trigger
-            # to occur after sending *trg to the instrument.
-
-            smu.trigger.arm.stimulus = self.trigger.EVENT_ID
-
-            # Prepare an event blender (blender #1) that triggers when
-            # the smua enters the trigger layer or reaches the end of a
-            # single trigger layer cycle.
-
-            # triggers when either of the stimuli are true ('or enable')
-            self.trigger.blender[1].orenable = True
-            self.trigger.blender[1].stimulus[1] = smu.trigger.ARMED_EVENT_ID
-            self.trigger.blender[1].stimulus[2] = smu.trigger.PULSE_COMPLETE_EVENT_ID
-
-            # SET THE smu SOURCE STIMULUS TO BE EVENT BLENDER #1
-            # A source measure cycle within the trigger layer will occur when
-            # either the trigger layer is entered (termed 'armed event') for the
-            # first time or a single cycle of the trigger layer is complete (termed
-            # 'pulse complete event').
-
-            smu.trigger.source.stimulus = self.trigger.blender[1].EVENT_ID
-
-            # PREPARE AN EVENT BLENDER (blender #2) THAT TRIGGERS WHEN BOTH SMU'S
-            # HAVE COMPLETED A MEASUREMENT.
-            # This is needed to prevent the next source measure cycle from occurring
-            # before the measurement on both channels is complete.
-
-            self.trigger.blender[2].orenable = True  # triggers when both stimuli are true
-            self.trigger.blender[2].stimulus[1] = smu.trigger.MEASURE_COMPLETE_EVENT_ID
-
-            # SET THE SMU ENDPULSE STIMULUS TO BE EVENT BLENDER #2
-            smu.trigger.endpulse.stimulus = self.trigger.blender[2].EVENT_ID
-
-            # TURN ON smu
-            smu.source.output = smu.OUTPUT_ON
-
-            # INITIATE MEASUREMENT
-            # prepare SMUs to wait for trigger
-            smu.trigger.initiate()
-
-            # send trigger
-            self.send_trigger()
-
-            # CHECK STATUS BUFFER FOR MEASUREMENT TO FINISH
-            # Possible return values:
-            # 6 = smua and smub sweeping
-            # 4 = only smub sweeping
-            # 2 = only smua sweeping
-            # 0 = neither smu sweeping
-
-            # while loop that runs until the sweep begins
-            while self.status.operation.sweeping.condition == 0:
-                time.sleep(0.1)
+            filter_count = int(filter_count)
+            if not 1 <= filter_count <= 100:
+                raise ValueError("Filter count must be between 1 and 100.")
+
+            # configure the trigger model and start the SMU in a single write,
+            # see _SINGLE_SWEEP_SCRIPT
+            key = ("single", smu._name, float(t_int), float(delay), filter_count, end_pulse_action)
+            sweep_fn = self._sweep_fn_cache.get(key) or self._define_sweep_function(
+                key,
+                "tb_single_sweep",
+                smu._name,
+                f"display.{self._get_smu_name(smu)}",
+                repr(self._get_nplc(t_int)),
+                repr(float(delay)),
+                str(filter_count),
+                str(end_pulse_action),
+            )
+            self._write(f"{sweep_fn}({smu_sweeplist.size})")
 
-            # while loop that runs until the sweep ends
-            while self.status.operation.sweeping.condition > 0:
-                time.sleep(0.1)
+            # send trigger and wait for the sweep to finish
+            if progress is None:
+                srq = self._arm_sweep_srq(smu)
+                self.send_trigger()
+                finished = self._wait_for_sweep(srq)
+            else:
+                self.send_trigger()
+                finished = self._wait_for_sweep_live((smu,), smu_sweeplist.size, progress)
+
+            if not finished:
+                # there is no outer loop resetting the device, see _outer_sweep
+                self._stop_sweep(smu)
+                self.reset()
+                self.beeper.beep(0.3, 2400)
+                return v_smu, i_smu
 
             # EXTRACT DATA FROM SMU BUFFERS
-            i_smu = self.read_buffer(smu.nvbuffer1)
-            v_smu = self.read_buffer(smu.nvbuffer2)
-
-            smu.nvbuffer1.clear()
-            smu.nvbuffer2.clear()
+            i_smu = self._read_buffer_fast(smu.nvbuffer1)
+            v_smu = self._read_buffer_fast(smu.nvbuffer2)
 
-            smu.nvbuffer1.clearcache()
-            smu.nvbuffer2.clearcache()
+            # CLEAR BUFFERS
+            self._clear_buffers(smu)
 
             return v_smu, i_smu
             
 
 class Keithley2600ExtendFactory:
 
-    _instances: Set[_Keithley2600Extend] = set()
+    _instances: Dict[str, _Keithley2600Extend] = {}
 
     def __new__(cls, *args, **kwargs) -> _Keithley2600Extend:
         """
@@ -759,13 +1154,24 @@ class Keithley2600ExtendFactory:
         """
         address = args[0]
 
-        for instance in cls._instances:
-            if instance.visa_address == address:
-                logger.debug("Returning existing instance with address '%s'.", address)
-                return instance
+        instance = cls._instances.get(address)
+        if instance is not None:
+            logger.debug("Returning existing instance with address '%s'.", address)
+            return instance
 
-        logger.debug("Creating new instance with address '%s'.", args[0])
+        logger.debug("Creating new instance with address '%s'.", address)
         instance = _Keithley2600Extend(*args, **kwargs)
-        cls._instances.add(instance)
+        cls._instances[address] = instance
 
         return instance
+
+    @classmethod
+    def close_all(cls) -> None:
+        """
+        Disconnects all instances created by the factory and forgets them, so
+        later calls create new instances. Called when the app quits, see
+        :func:`tb_window.run_app`.
+        """
+        for instance in cls._instances.values():
+            instance.disconnect()
+        cls._instances.clear()
@@ -1,7 +1,8 @@
 import logging
+import threading
 
-from time import sleep
 from datetime import datetime
+from time import monotonic
 from pathlib import Path
 import numpy as np
 
@@ -13,7 +14,7 @@ from pymeasure.experiment import FloatParameter, BooleanParameter, Parameter, Me
 if not settings['in_simulation']:
     from secop.client import SecopClient
 
-from keithley2600_extend import Keithley2600ExtendFactory
+from keithley2600_extend import Keithley2600ExtendFactory, sweep_steps
 
 ###############################################################################
 ## does not work:
@@ -38,6 +39,27 @@ from keithley2600_extend import Keithley2600ExtendFactory
 log = logging.getLogger(__name__)
 
     
+class SecopClientFactory:
+
+    _instances = {}
+
+    def __new__(cls, address):
+        """
+        Create new client for a new secnode address, otherwise return existing client,
+        so that consecutive procedures share one connection.
+        """
+        client = cls._instances.get(address)
+        if client is not None:
+            log.debug("Returning existing secnode client with address '%s'.", address)
+            return client
+
+        log.debug("Creating new secnode client with address '%s'.", address)
+        client = SecopClient(address)
+        cls._instances[address] = client
+
+        return client
+    
+    
 
 class ATBProcedure(Procedure):
     temperature_SP = FloatParameter('Temperature SP', units='K', default=300)
@@ -50,43 +72,137 @@ class ATBProcedure(Procedure):
     
     starttime = Metadata('Start time', fget=datetime.now)
     
-    secnode_connected = False  
+    # True once this procedure receives the updates of the secnode
+    secnode_subscribed = False  
+    
+    # SECoP modules of temperature and magnetic field
+    SECNODE_MODULES = ("tt", "mf")
+    
+    # wait for a status update at most this long before checking the stop flag
+    STABLE_WAIT_TIMEOUT = 0.5
+    
+    # a stable status counts only this long after a new target was written,
+    # the status read right after the write may still be the old one
+    STABLE_MIN_WAIT = 1.0
+    
+    # values read by get_temperature() / get_m_field() are reused for this long
+    POLL_MAX_AGE = 0.5
     
     
     def startup(self):
         log.info(f"{str(self.__class__.__name__)}.startup()...")
         self.k_device = Keithley2600ExtendFactory(settings['keithley_address'], '')
+        # set by _on_secnode_update while the status of a module is stable
+        self._stable_events = {module: threading.Event() for module in self.SECNODE_MODULES}
+        # last status of each module and the time its target was last written
+        self._status = {}
+        self._target_times = {}
+        # last value of each module pushed by the secnode
+        self._values = {}
+        # module -> (value, status, time of the read), see _poll
+        self._poll_cache = {}
+        self._poll_lock = threading.Lock()
         if not settings['in_simulation']:
-            self.secnode = SecopClient(settings['secnode_address'])
+            self.secnode = SecopClientFactory(settings['secnode_address'])
         if self.temperature_ctrl_active or self.mag_field_ctrl_active:
             self.check_secnode()
             
              
     def shutdown(self):
-        # nothing to do...
-        pass
+        if self.secnode_subscribed:
+            for module in self.SECNODE_MODULES:
+                self.secnode.unregister_callback(module, updateEvent=self._on_secnode_update)
         
     ###########################################################################
     
     def check_secnode(self):
-        if not self.secnode_connected:
+        if not self.secnode.online:
             log.info("Connecting to secnode...")
             self.secnode.connect()
-            self.secnode_connected = True
             log.info("... done")
+        if not self.secnode_subscribed:
+            self.secnode_subscribed = True
+            # status changes are pushed by the secnode instead of being polled
+            for module in self.SECNODE_MODULES:
+                self.secnode.register_callback(module, updateEvent=self._on_secnode_update)
+                self._read_status(module)
+
+
+    def _on_secnode_update(self, module, parameter, value, timestamp, readerror):
+        # called by the SecopClient thread on every update of a registered module
+        if readerror is not None:
+            return
+        if parameter == "status":
+            self._update_stable_event(module, value)
+        elif parameter == "value":
+            self._values[module] = value
+
+
+    def _update_stable_event(self, module, status):
+        self._status[module] = status
+        written = self._target_times.get(module)
+        settled = written is None or monotonic() - written >= self.STABLE_MIN_WAIT
+        if settled and 100 <= status[0] < 200:
+            self._stable_events[module].set()
+        else:
+            self._stable_events[module].clear()
+
+
+    def _read_status(self, module):
+        # an explicit read, the status is pushed only when it changes
+        self._update_stable_event(module, self.secnode.getParameter(module, "status")[0])
+
+
+    def _write_target(self, module, value):
+        # not stable until a status newer than STABLE_MIN_WAIT says so
+        self._target_times[module] = monotonic()
+        self._stable_events[module].clear()
+        self.secnode.setParameter(module, "target", value)
+
+
+    def _wait_stable(self, module, timeout):
+        if self._stable_events[module].wait(timeout):
+            return True
+        # no update arrived, e.g. the target equals the current value and the
+        # status never left IDLE: the last status counts after STABLE_MIN_WAIT
+        status = self._status.get(module)
+        if status is not None:
+            self._update_stable_event(module, status)
+        return self._stable_events[module].is_set()
+
+
+    def _read_module(self, module):
+        # the pushed value if there is one, otherwise a single read
+        value = self._values.get(module)
+        if value is None:
+            value = self._values[module] = self.secnode.getParameter(module, "value")[0]
+        return value
+
+
+    def _poll(self, module):
+        # value and status read together, reused for POLL_MAX_AGE seconds
+        with self._poll_lock:
+            now = monotonic()
+            cached = self._poll_cache.get(module)
+            if cached is None or now - cached[2] >= self.POLL_MAX_AGE:
+                value = self.secnode.getParameter(module, "value")[0]
+                status = self.secnode.getParameter(module, "status")[0]
+                self._update_stable_event(module, status)
+                cached = self._poll_cache[module] = (value, status, now)
+            return cached
 
 
     def get_temperature(self):
         if self.temperature_ctrl_active:
             self.check_secnode()
-            return self.secnode.getParameter("tt", "value")[0]
+            return self._poll("tt")[0]
         return -1.0
         
         
     def set_temperature(self, value):
         if self.temperature_ctrl_active:
             self.check_secnode()
-            self.secnode.setParameter("tt", "target", value)
+            self._write_target("tt", value)
             log.info(f"T_SP = {value}K...")
         else:
             log.info("... T control disabled. Skipping setParameter()")
@@ -95,30 +211,32 @@ class ATBProcedure(Procedure):
     def get_m_field(self):
         if self.mag_field_ctrl_active:
             self.check_secnode()
-            return self.secnode.getParameter("mf", "value")[0]
+            return self._poll("mf")[0]
         return -1.0
         
         
     def set_m_field(self, value):
         if self.mag_field_ctrl_active:
             self.check_secnode()
-            self.secnode.setParameter("mf", "target", value)
+            self._write_target("mf", value)
             log.info(f"B_SP = {value}T...")
         else:
             log.info("... M control disabled. Skipping setParameter()")
         
         
-    def is_temperature_stable(self):
+    # wait up to timeout seconds for the status to become stable
+    def is_temperature_stable(self, timeout=0):
         if self.temperature_ctrl_active:
             self.check_secnode()
-            return (100 <= self.secnode.getParameter("tt", "status")[0][0] < 200)
+            return self._wait_stable("tt", timeout)
         return True
         
         
-    def is_m_field_stable(self):
+    # wait up to timeout seconds for the status to become stable
+    def is_m_field_stable(self, timeout=0):
         if self.mag_field_ctrl_active:
             self.check_secnode()
-            return (100 <= self.secnode.getParameter("mf", "status")[0][0] < 200)
+            return self._wait_stable("mf", timeout)
         return True
         
         
@@ -130,34 +248,67 @@ class ATBProcedure(Procedure):
         log.info(f"Trying to set B_SP = {self.mag_field_SP}T...")
         self.set_m_field(self.mag_field_SP)
         
-        t_stable = False; m_stable = False
-        while not (t_stable and m_stable):
-            if self.should_stop():
-                log.warning("Caught the stop flag in the procedure")
-                return True
-                
-            sleep(1)
-            if not t_stable:
-                if self.is_temperature_stable():
-                    log.info(f"Temperature stabilized ... T_SP = {self.temperature_SP}, T = {self.get_temperature()}")
-                    t_stable = True
-                else:
-                    log.info(f"Waiting to stabilize temperature ... T_SP = {self.temperature_SP}, T = {self.get_temperature()}")
-            if not m_stable:
-                if self.is_m_field_stable():
-                    log.info(f"Mag field stabilized ... B_SP = {self.mag_field_SP}, B = {self.get_m_field()}")
-                    m_stable = True
-                else:
-                    log.info(f"Waiting to stabilize mag field ... B_SP = {self.mag_field_SP}, B = {self.get_m_field()}")
+        # connected and subscribed once here, the threads below only wait for
+        # the pushed status and never touch the shared SecopClient setup
+        if self.temperature_ctrl_active or self.mag_field_ctrl_active:
+            self.check_secnode()
         
-        if self.should_stop():
-                log.warning("Caught the stop flag in the procedure")
-                return True
+        cancel = threading.Event()
+        errors = []
+        
+        # runs in its own thread per channel, so that the wait after one channel
+        # has stabilized overlaps with waiting for the other one
+        def wait_stable(name, symbol, sp, module, active, wait_after, done):
+            try:
+                while not cancel.is_set():
+                    # blocks until the status update arrives or the timeout expires
+                    if not active or self._wait_stable(module, self.STABLE_WAIT_TIMEOUT):
+                        break
+                    # the logged value comes with the updates, only read if logged
+                    if log.isEnabledFor(logging.DEBUG):
+                        value = self._read_module(module) if active else -1.0
+                        log.debug("Waiting to stabilize %s ... %s_SP = %s, %s = %s",
+                                  name.lower(), symbol, sp, symbol, value)
+                else:
+                    return
                 
-        if self.temperature_ctrl_active or self.mag_field_ctrl_active:
-            sleep_secs = np.max([settings['wait_after_stab_M'], settings['wait_after_stab_T']])
-            log.info(f"Waiting another {sleep_secs}s...")
-            sleep(sleep_secs)
+                value = self._read_module(module) if active else -1.0
+                log.info("%s stabilized ... %s_SP = %s, %s = %s", name, symbol, sp, symbol, value)
+                
+                if active:
+                    log.info("Waiting another %ss for %s...", wait_after, name.lower())
+                    if cancel.wait(wait_after):
+                        return
+            except Exception as e:
+                errors.append(e)
+            done.set()
+        
+        channels = [
+            ("Temperature", "T", self.temperature_SP, "tt",
+             self.temperature_ctrl_active, settings['wait_after_stab_T']),
+            ("Mag field", "B", self.mag_field_SP, "mf",
+             self.mag_field_ctrl_active, settings['wait_after_stab_M']),
+        ]
+        threads = []; dones = []
+        for channel in channels:
+            done = threading.Event()
+            thread = threading.Thread(target=wait_stable, args=(*channel, done), daemon=True)
+            thread.start()
+            threads.append(thread); dones.append(done)
+        
+        for done in dones:
+            while not done.wait(self.STABLE_WAIT_TIMEOUT):
+                if self.should_stop():
+                    cancel.set()
+                    for thread in threads:
+                        thread.join()
+                    log.warning("Caught the stop flag in the procedure")
+                    return True
+        
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
         
         return False
         
@@ -189,6 +340,11 @@ class TBGProcedure(ATBProcedure):
 
     def execute(self):
         log.info(f"{str(self.__class__.__name__)}.execute()...")
+        drain_channel = settings['drain_channel']
+        t_int = settings['keithley_integr_time'] # Must be between 0.001 to 25 times the power line frequency (50Hz or 60Hz).
+        filter_count = settings['keithley_filter_count']
+        have_t = bool(self.temperature_ctrl_active)
+        have_b = bool(self.mag_field_ctrl_active)
         
         if self.stabilize_TB():
             return
@@ -197,15 +353,67 @@ class TBGProcedure(ATBProcedure):
             log.warning("Caught the stop flag in the procedure")
             return
                 
-        log.info(f"Starting Keithley measurement... B = {self.get_m_field()}, B_SP = {self.mag_field_SP}, T = {self.get_temperature()}, T_SP = {self.temperature_SP}")
+        # reads T and B, only if the message is logged
+        if log.isEnabledFor(logging.INFO):
+            log.info(f"Starting Keithley measurement... B = {self.get_m_field()}, B_SP = {self.mag_field_SP}, T = {self.get_temperature()}, T_SP = {self.temperature_SP}")
         
-        if settings['drain_channel'] == 'B':
+        if drain_channel == 'B':
             smu_gate = self.k_device.smua
             smu_drain = self.k_device.smub
         else:
             smu_gate = self.k_device.smub
             smu_drain = self.k_device.smua
         
+        # bound once for the loop
+        emit = self.emit
+        debug = log.debug
+        emitted = 0
+        
+        # called with every batch of new points while the gate sweep runs
+        def emit_rows(idrain, df):
+            nonlocal emitted
+            vdlist = df['Vd'].to_numpy()
+            idlist = df['Id'].to_numpy()
+            # NaN instead of inf where no current flows
+            rdslist = np.divide(vdlist, idlist, out=np.full_like(vdlist, np.nan), where=idlist != 0)
+            
+            # last values pushed by the secnode, see _on_secnode_update
+            _t = self._read_module("tt") if have_t else -1.0
+            _m = self._read_module("mf") if have_b else -1.0
+            # same for every row of the batch, a single drain current is measured
+            base = {
+                'Temperature SP': self.temperature_SP, 
+                'Mag field SP': self.mag_field_SP, 
+                'Id SP': self.drain_current_SP, 
+                'Temperature': _t,
+                'Mag field': _m,
+                'Sample': self.sample
+            }
+            # plain Python lists of the columns, iterated together
+            rows = zip(
+                df.index.tolist(),
+                df['Vg_SP'].tolist(),
+                df['Vg_dir_fwd'].tolist(),
+                df['Vg'].tolist(),
+                df['Ig'].tolist(),
+                vdlist.tolist(),
+                idlist.tolist(),
+                rdslist.tolist(),
+            )
+            for index, vg_sp, vg_dir_fwd, vg, ig, vd, id, rds in rows:
+                data = base.copy()
+                data['Index'] = index
+                data['Vg SP'] = vg_sp
+                data['Vg direction fwd'] = vg_dir_fwd
+                data['Vg'] = vg
+                data['Ig'] = ig
+                data['Vd'] = vd
+                data['Id'] = id
+                data['Rds'] = rds
+                emit('results', data) # not possible to emit array...
+                debug("Emitting results: %s", data)
+            emitted += len(df)
+        
         df = self.k_device.transfer_measurement_i(
             smu_gate = smu_gate,
             smu_drain = smu_drain,
@@ -213,40 +421,23 @@ class TBGProcedure(ATBProcedure):
             vg_stop = self.gate_voltage_max,
             vg_step = self.gate_voltage_step,
             id_list = [self.drain_current_SP],
-            t_int = settings['keithley_integr_time'], # Must be between 0.001 to 25 times the power line frequency (50Hz or 60Hz).
+            t_int = t_int,
             delay = -1, # automatically starts a measurement once the current is stable
             pulsed = False, # do not reset to zero between data points
+            filter_count = filter_count,
+            progress = emit_rows, # data points are plotted as they are measured
         )
-        df['Rds'] = df['Vd'] / df['Id']
         
-        _t = self.get_temperature()
-        _m = self.get_m_field()
-        for index, row in df.iterrows():
-            data = {
-                'Index': index,
-                'Temperature SP': self.temperature_SP, 
-                'Mag field SP': self.mag_field_SP, 
-                'Vg SP': row['Vg_SP'], 
-                'Id SP': row['Id_SP'], 
-                'Temperature': _t,
-                'Mag field': _m,
-                'Vg direction fwd': row['Vg_dir_fwd'],
-                'Vg': row['Vg'],
-                'Ig': row['Ig'],
-                'Vd': row['Vd'],
-                'Id': row['Id'],
-                'Rds': row['Rds'],
-                'Sample': self.sample
-            }
-            self.emit('results', data) # not possible to emit array...
-            log.debug("Emitting results: %s" % data)
+        # points not seen during the sweep
+        if len(df) > emitted:
+            emit_rows(self.drain_current_SP, df.iloc[emitted:])
     
     
 ###############################################################################
 class TBIVProcedure(ATBProcedure):
-    drain_currennt_min = FloatParameter('Id min', units='A', default=0)
-    drain_currennt_max = FloatParameter('Id max', units='A', default=100e-6)
-    drain_currennt_step = FloatParameter('Id step', units='A', default=5e-6)
+    drain_current_min = FloatParameter('Id min', units='A', default=0)
+    drain_current_max = FloatParameter('Id max', units='A', default=100e-6)
+    drain_current_step = FloatParameter('Id step', units='A', default=5e-6)
     
     DATA_COLUMNS = [
         'Index', 
@@ -264,6 +455,11 @@ class TBIVProcedure(ATBProcedure):
 
     def execute(self):
         log.info(f"{str(self.__class__.__name__)}.execute()...")
+        drain_channel = settings['drain_channel']
+        t_int = settings['keithley_integr_time'] # Must be between 0.001 to 25 times the power line frequency (50Hz or 60Hz).
+        filter_count = settings['keithley_filter_count']
+        have_t = bool(self.temperature_ctrl_active)
+        have_b = bool(self.mag_field_ctrl_active)
         
         if self.stabilize_TB():
             return
@@ -272,43 +468,69 @@ class TBIVProcedure(ATBProcedure):
             log.warning("Caught the stop flag in the procedure")
             return
                 
-        log.info(f"Starting Keithley measurement... B = {self.get_m_field()}, B_SP = {self.mag_field_SP}, T = {self.get_temperature()}, T_SP = {self.temperature_SP}")
+        # reads T and B, only if the message is logged
+        if log.isEnabledFor(logging.INFO):
+            log.info(f"Starting Keithley measurement... B = {self.get_m_field()}, B_SP = {self.mag_field_SP}, T = {self.get_temperature()}, T_SP = {self.temperature_SP}")
         
-        sweeplist_drain = np.arange(
-            self.drain_currennt_min, 
-            self.drain_currennt_max + self.drain_currennt_step, 
-            self.drain_currennt_step
+        sweeplist_drain = sweep_steps(
+            self.drain_current_min, self.drain_current_max, self.drain_current_step
         )
         
-        if settings['drain_channel'] == 'B':
+        if drain_channel == 'B':
             smu_drain = self.k_device.smub
         else:
             smu_drain = self.k_device.smua
         
-        vdlist, idlist = self.k_device.current_sweep_single_smu(
-            smu = smu_drain,
-            smu_sweeplist = sweeplist_drain,
-            t_int = settings['keithley_integr_time'], # Must be between 0.001 to 25 times the power line frequency (50Hz or 60Hz).
-            delay = -1, # automatically starts a measurement once the current is stable
-            pulsed = False, # do not reset to zero between data points
-        )
+        # bound once for the loop
+        emit = self.emit
+        debug = log.debug
+        emitted = 0
         
-        _t = self.get_temperature()
-        _m = self.get_m_field()
-        for index, (idsp, vd, id) in enum(zip(sweeplist_drain, vdlist, idlist)):
-            data = {
-                'Index': index,
+        # called with every batch of new points while the sweep runs
+        def emit_rows(vdlist, idlist):
+            nonlocal emitted
+            # NaN instead of inf where no current flows
+            rdslist = np.divide(vdlist, idlist, out=np.full_like(vdlist, np.nan), where=idlist != 0)
+            
+            # last values pushed by the secnode, see _on_secnode_update
+            _t = self._read_module("tt") if have_t else -1.0
+            _m = self._read_module("mf") if have_b else -1.0
+            # same for every row of the batch
+            base = {
                 'Temperature SP': self.temperature_SP, 
                 'Mag field SP': self.mag_field_SP, 
-                'Id SP': idsp, 
                 'Temperature': _t,
                 'Mag field': _m,
-                'Vd': vd,
-                'Id': id,
-                'Rds': vd / id,
                 'Sample': self.sample
             }
-            self.emit('results', data) # not possible to emit array...
-            log.debug("Emitting results: %s" % data)
-    
-    
\ No newline at end of file
+            # plain Python lists of the columns, iterated together
+            rows = zip(
+                sweeplist_drain[emitted:emitted + vdlist.size].tolist(),
+                vdlist.tolist(),
+                idlist.tolist(),
+                rdslist.tolist(),
+            )
+            for index, (idsp, vd, id, rds) in enumerate(rows, start=emitted):
+                data = base.copy()
+                data['Index'] = index
+                data['Id SP'] = idsp
+                data['Vd'] = vd
+                data['Id'] = id
+                data['Rds'] = rds
+                emit('results', data) # not possible to emit array...
+                debug("Emitting results: %s", data)
+            emitted += vdlist.size
+        
+        vdlist, idlist = self.k_device.current_sweep_single_smu(
+            smu = smu_drain,
+            smu_sweeplist = sweeplist_drain,
+            t_int = t_int,
+            delay = -1, # automatically starts a measurement once the current is stable
+            pulsed = False, # do not reset to zero between data points
+            filter_count = filter_count,
+            progress = emit_rows, # data points are plotted as they are measured
+        )
+        
+        # points not seen during the sweep
+        if vdlist.size > emitted:
+            emit_rows(vdlist[emitted:], idlist[emitted:])
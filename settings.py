@@ -5,6 +5,8 @@ settings = {
     'drain_channel': 'B', # either 'A' or 'B'.
     'keithley_integr_time': 20e-3,  # Seconds. Must be between 0.001 to 25 times 
                                     # the power line periode (20 ms for 50Hz).
+    'keithley_filter_count': 1, # Readings averaged per data point, 1 to 100. 
+                                # 1 leaves the instrument's filter settings unchanged.
     
     'secnode_address': 'kfes38.troja.mff.cuni.cz:5000',
     'wait_after_stab_M': 10, # Seconds
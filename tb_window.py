@@ -0,0 +1,395 @@
+import logging
+log = logging.getLogger(__name__)
+
+import os
+import sys
+from datetime import datetime
+from functools import lru_cache
+import string
+from collections import ChainMap, deque
+
+from settings import settings
+from keithley2600_extend import Keithley2600ExtendFactory
+
+from pymeasure.display.Qt import QtCore, QtWidgets
+from pymeasure.display.windows import ManagedWindow
+from pymeasure.display.widgets.sequencer_widget import SequenceEvaluationError
+from pymeasure.experiment import Procedure, Results
+
+# resolved once, filenames are built with plain string operations
+_OUT_DIR = os.path.abspath(os.fspath(settings['out_dir']))
+
+_FORMATTER = string.Formatter()
+
+
+@lru_cache(maxsize=256)
+def _render_prefix(prefix_parts, values):
+    """
+    Joins a prefix parsed by ``string.Formatter().parse`` with the placeholder
+    ``values``, given in the order of the fields. Sequences often repeat the
+    same sample, T and B, so results are cached.
+    """
+    parts = []
+    values = iter(values)
+    for literal, field, spec, conversion in prefix_parts:
+        parts.append(literal)
+        if field is not None:
+            value = _FORMATTER.convert_field(next(values), conversion)
+            parts.append(_FORMATTER.format_field(value, spec))
+    return ''.join(parts)
+
+
+def _unique_filename(prefix, date):
+    """
+    Returns a unique data file path ``<prefix><date>_<index>.csv`` in the output
+    directory. Follows the naming of pymeasure's ``unique_filename``, but the
+    prefix must already be substituted and the directory must exist.
+
+    :param prefix: Substituted file prefix.
+    :param date: Date string, e.g. ``datetime.now().strftime('%Y-%m-%d')``.
+    """
+    basepath = os.path.join(_OUT_DIR, prefix + date)
+    index = 1
+    filename = f'{basepath}_{index}.csv'
+    while os.path.exists(filename):
+        index += 1
+        filename = f'{basepath}_{index}.csv'
+    return filename
+
+
+class _EnqueueSignals(QtCore.QObject):
+    # (number of procedures handled, list of Results)
+    results_ready = QtCore.Signal(int, object)
+
+
+class EnqueueTask(QtCore.QRunnable):
+    """
+    Creates the data files of procedures to be queued outside of the GUI thread.
+    ``procedures`` are ``(procedure, date)`` pairs, the date is recorded when the
+    procedure is queued. The resulting list of :class:`Results` is emitted by
+    ``signals.results_ready`` together with the number of procedures handled.
+    """
+    def __init__(self, make_results, procedures, signals):
+        super().__init__()
+        self.make_results = make_results
+        self.procedures = procedures
+        self.signals = signals
+
+    def run(self):
+        results = []
+        for procedure, date in self.procedures:
+            try:
+                results.append(self.make_results(procedure, date))
+            except Exception:
+                log.exception("Creating data file failed, procedure not queued.")
+        self.signals.results_ready.emit(len(self.procedures), results)
+
+
+class TBMainWindow(ManagedWindow):
+    """
+    Common main window of the T/B dependent measurements. Concrete windows are
+    created by :func:`make_main_window`, which fills in the class attributes below.
+    """
+    procedure_class = None
+    INPUTS = ()
+    DISPLAYS = ('temperature_SP', 'mag_field_SP', 'sample')
+    SEQUENCER_INPUTS = ('temperature_SP', 'mag_field_SP')
+    x_axis = None
+    y_axis = None
+    sequence_file = None
+    prefix = 'DATA_'
+    title = ''
+
+    # prefix parsed by string.Formatter, see make_main_window()
+    _prefix_parts = (('DATA_', None, None, None),)
+
+    # maximum number of experiments waiting in the manager queue; further
+    # procedures are held back until queued experiments have finished
+    _MAX_PENDING = 16
+
+    def __init__(self):
+        super().__init__(
+            procedure_class=self.procedure_class,
+            inputs=self.INPUTS,
+            displays=self.DISPLAYS,
+            x_axis=self.x_axis,
+            y_axis=self.y_axis,
+            sequencer=True,
+            sequencer_inputs=self.SEQUENCER_INPUTS,
+            sequence_file=self.sequence_file,
+        )
+        self.setWindowTitle(self.title)
+        self._proc_cls_name = self.procedure_class.__name__
+
+        os.makedirs(_OUT_DIR, exist_ok=True)
+
+        # queue the whole sequence at once instead of one queue() call per entry
+        self.sequencer.queue_button.clicked.disconnect()
+        self.sequencer.queue_button.clicked.connect(self.queue_sequence)
+
+        # data files are created by EnqueueTask; a single thread keeps the
+        # queue order and avoids two tasks picking the same unique filename
+        self._enqueue_pool = QtCore.QThreadPool(self)
+        self._enqueue_pool.setMaxThreadCount(1)
+        self._enqueue_signals = _EnqueueSignals(self)
+        self._enqueue_signals.results_ready.connect(self._queue_results)
+
+        self._backlog = deque()
+        self._in_flight = 0  # procedures handed to EnqueueTask, not yet queued
+        self._discarded = 0  # of those, the ones to be dropped, see _discard_backlog
+        # a failed experiment makes room as well; after an abort the backlog is
+        # kept and drained again by resume()
+        self.manager.finished.connect(self._experiment_finished)
+        self.manager.failed.connect(self._experiment_finished)
+
+        self._backlog_label = QtWidgets.QLabel(self)
+        self._backlog_label.hide()
+        self.statusBar().addPermanentWidget(self._backlog_label)
+
+
+    def _format_prefix(self, procedure):
+        """
+        Substitutes the ``{Parameter name}`` placeholders of :attr:`prefix` with
+        the parameter values of ``procedure``.
+        """
+        values = {param.name: param.value for param in procedure.parameter_objects().values()}
+        return _render_prefix(
+            self._prefix_parts,
+            tuple(values[field] for _, field, _, _ in self._prefix_parts if field is not None),
+        )
+
+
+    def _make_results(self, procedure, date):
+        filename = _unique_filename(self._format_prefix(procedure), date)
+        return Results(procedure, filename)
+
+
+    def _queued_count(self):
+        return sum(
+            experiment.procedure.status == Procedure.QUEUED
+            for experiment in self.manager.experiments.queue
+        )
+
+
+    def _pending_count(self):
+        return self._queued_count() + self._in_flight - self._discarded
+
+
+    def _update_backlog_label(self):
+        count = len(self._backlog)
+        self._backlog_label.setText(f"{count} procedures waiting to be queued")
+        self._backlog_label.setVisible(count > 0)
+
+
+    def _drain_backlog(self):
+        free = min(self._MAX_PENDING - self._pending_count(), len(self._backlog))
+        if free > 0:
+            procedures = [self._backlog.popleft() for _ in range(free)]
+            self._in_flight += len(procedures)
+            self._enqueue_pool.start(
+                EnqueueTask(self._make_results, procedures, self._enqueue_signals)
+            )
+            if self._backlog:
+                log.info("%d procedures waiting to be queued.", len(self._backlog))
+        self._update_backlog_label()
+
+
+    def _held_back_count(self):
+        # procedures not handed to the manager yet
+        return len(self._backlog) + self._in_flight - self._discarded
+
+
+    def _discard_backlog(self, reason):
+        """
+        Drops the procedures held back by :meth:`queue_batch`, including those
+        whose data files are being created, so they are not queued ahead of
+        the next :meth:`queue` call.
+        """
+        count = self._held_back_count()
+        if count:
+            log.warning("%s, %d procedures not queued.", reason, count)
+        self._backlog.clear()
+        self._discarded = self._in_flight
+        self._update_backlog_label()
+
+
+    def _experiment_finished(self, experiment):
+        # the manager starts the next experiment only after emitting 'finished'
+        QtCore.QTimer.singleShot(0, self._drain_backlog)
+
+
+    def abort_returned(self, experiment):
+        super().abort_returned(experiment)
+        if self._backlog and not self.manager.experiments.has_next():
+            # only held-back procedures are left, they can still be resumed
+            self.abort_button.setText("Resume")
+            self.abort_button.setEnabled(True)
+
+
+    def resume(self):
+        if self._backlog and not self.manager.experiments.has_next():
+            # the manager starts the held-back procedures as they are queued
+            self.abort_button.setText("Abort")
+            self.abort_button.clicked.disconnect()
+            self.abort_button.clicked.connect(self.abort)
+            self.manager.resume()
+        else:
+            super().resume()
+        self._drain_backlog()
+
+
+    def _queue_results(self, count, results_list):
+        """
+        Creates experiments for results prepared by :class:`EnqueueTask` and
+        hands them to the manager. Runs in the GUI thread.
+        """
+        self._in_flight -= count
+        if self._discarded:
+            # EnqueueTasks run one at a time, so the discarded ones come first
+            self._discarded -= count
+            for results in results_list:
+                try:
+                    os.remove(results.data_filename)
+                except OSError:
+                    log.exception('Removing data file "%s" failed.', results.data_filename)
+            return
+
+        if len(results_list) == 1:
+            results = results_list[0]
+            log.info(
+                'Creating new experiment %s. Output file: "%s"',
+                self._proc_cls_name, results.data_filename
+            )
+        elif results_list:
+            log.info(
+                'Creating %d new experiments %s. Output directory: "%s"',
+                len(results_list), self._proc_cls_name, _OUT_DIR
+            )
+
+        for results in results_list:
+            experiment = self.new_experiment(results)
+            self.manager.queue(experiment)
+
+        # procedures whose data file could not be created leave room as well
+        self._drain_backlog()
+
+
+    def clear_experiments(self):
+        self._discard_backlog("Experiments cleared")
+        super().clear_experiments()
+
+
+    def remove_experiment(self, experiment):
+        queued = self._queued_count()
+        super().remove_experiment(experiment)
+        self._queue_shrunk(queued)
+
+
+    def delete_experiment_data(self, experiment):
+        queued = self._queued_count()
+        super().delete_experiment_data(experiment)
+        self._queue_shrunk(queued)
+
+
+    def _queue_shrunk(self, queued_before):
+        queued = self._queued_count()
+        held_back = self._held_back_count()
+        if queued == 0 < queued_before and held_back:
+            # the backlog continues the queue the user has just emptied
+            reply = QtWidgets.QMessageBox.question(
+                self, 'Held-back Procedures',
+                f"{held_back} more procedures are waiting to be queued. Discard them as well?",
+                QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No,
+                QtWidgets.QMessageBox.StandardButton.No,
+            )
+            if reply == QtWidgets.QMessageBox.StandardButton.Yes:
+                self._discard_backlog("Queued experiments removed")
+                return
+        if queued < queued_before:
+            self._drain_backlog()
+
+
+    def queue(self, procedure=None):
+        if procedure is None:
+            procedure = self.make_procedure()
+
+        self.queue_batch([procedure])
+
+
+    def queue_batch(self, procedures):
+        """
+        Queues several procedures at once. The data files are created in a
+        background thread, the experiments are then handed to the manager in
+        one go from the GUI thread. At most :attr:`_MAX_PENDING` experiments
+        wait in the manager queue, the rest is queued as experiments finish.
+
+        :param procedures: Procedures to be queued, in order of execution.
+        """
+        # one date for the whole batch, so its files sort together even if the
+        # backlog is drained after midnight
+        date = datetime.now().strftime('%Y-%m-%d')
+        self._backlog.extend((procedure, date) for procedure in procedures)
+        self._drain_backlog()
+
+
+    def queue_sequence(self):
+        """
+        Queues all entries of the sequencer with :meth:`queue_batch`.
+        """
+        queue_button = self.sequencer.queue_button
+        queue_button.setEnabled(False)
+
+        try:
+            sequence = self.sequencer.get_sequence()
+        except SequenceEvaluationError:
+            log.error("Evaluation of one of the sequence strings went wrong, no sequence queued.")
+        else:
+            procedures = []
+            for entry in sequence:
+                procedure = self.make_procedure()
+                procedure.set_parameters(dict(ChainMap(*entry[::-1])))
+                procedures.append(procedure)
+            self.queue_batch(procedures)
+        finally:
+            queue_button.setEnabled(True)
+
+
+def make_main_window(procedure_class, inputs, x_axis, y_axis, sequence_file, prefix, title):
+    """
+    Returns a :class:`TBMainWindow` subclass configured for one measurement.
+
+    :param procedure_class: Procedure run by the window.
+    :param inputs: Names of the procedure parameters shown as inputs.
+    :param x_axis: Data column plotted on the x axis.
+    :param y_axis: Data column plotted on the y axis.
+    :param sequence_file: Sequence file loaded into the sequencer.
+    :param prefix: Data file prefix, may contain ``{Parameter name}`` placeholders.
+    :param title: Window title.
+    """
+    return type(
+        f'{procedure_class.__name__}MainWindow',
+        (TBMainWindow,),
+        {
+            'procedure_class': procedure_class,
+            'INPUTS': tuple(inputs),
+            'x_axis': x_axis,
+            'y_axis': y_axis,
+            'sequence_file': sequence_file,
+            'prefix': prefix,
+            '_prefix_parts': tuple(_FORMATTER.parse(prefix)),
+            'title': title,
+        },
+    )
+
+
+def run_app(window_cls):
+    """
+    Shows a window of ``window_cls`` and runs the Qt event loop until it is
+    closed. An already existing ``QApplication`` is reused. The Keithley
+    connections are closed when the application quits.
+    """
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    app.aboutToQuit.connect(Keithley2600ExtendFactory.close_all)
+    window = window_cls()
+    window.show()
+    sys.exit(app.exec())